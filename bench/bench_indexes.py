@@ -0,0 +1,128 @@
+"""
+Benchmark de los índices secundarios (migración 3): borrado de personas por
+lote de importación, borrado de una marca de asistencia y filtros de
+Auditoría, antes y después de crear los índices.
+
+    python bench/bench_indexes.py [personas] [eventos_auditoria]
+
+Usa la base configurada en el entorno (DB_*), pero trabaja en un esquema
+aparte (bench_idx) que se borra al terminar. Cada operación corre dentro de
+una transacción que se revierte, así antes y después ven los mismos datos.
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from db import SLOTS, get_connection  # noqa: E402
+from migrations import SECONDARY_INDEXES, _m001_base  # noqa: E402
+
+SCHEMA = "bench_idx"
+ACTIONS = ["confirm_attendance", "clear_attendance", "create_person", "import_people", "delete_people_bulk"]
+
+
+def populate(cur, n_people: int, n_audit: int) -> None:
+    cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}; SET search_path = {SCHEMA}, public;")
+    _m001_base(cur)
+    cur.execute("""INSERT INTO people (document, names, region, entity)
+        SELECT (1000000 + g)::text, 'PERSONA ' || g, 'R' || (g %% 12), 'E' || (g %% 40)
+        FROM generate_series(1, %s) g;""", (n_people,))
+    cur.execute("""INSERT INTO assistance (person_id, slot, timestamp_utc)
+        SELECT p.id, s.slot, NOW() - (random() * interval '2 days')
+        FROM people p CROSS JOIN unnest(%s::text[]) s(slot)
+        WHERE random() < 0.6;""", (SLOTS,))
+    cur.execute("INSERT INTO attendance_slots (person_id) SELECT id FROM people;")
+    # lotes de 5000 personas
+    cur.execute("""INSERT INTO import_batch (username, total_rows, inserted_count)
+        SELECT 'admin', 5000, 5000 FROM generate_series(1, ceil(%s / 5000.0)::int);""", (n_people,))
+    cur.execute("INSERT INTO import_batch_people (batch_id, person_id) SELECT (id - 1) / 5000 + 1, id FROM people;")
+    cur.execute("""INSERT INTO audit_log (timestamp_utc, user_id, username, action, person_id, slot)
+        SELECT NOW() - (g * interval '1 second'), g %% 25,
+               CASE WHEN g %% 2000 = 0 THEN 'auditor' ELSE 'usuario' || (g %% 25) END,
+               CASE WHEN g %% 1000 = 0 THEN 'delete_import_batch' ELSE (%s::text[])[1 + g %% 5] END,
+               g %% %s + 1, (%s::text[])[1 + g %% 4]
+        FROM generate_series(1, %s) g;""", (ACTIONS, n_people, SLOTS, n_audit))
+    cur.execute("ANALYZE;")
+
+
+def timed(conn, fn) -> float:
+    with conn.cursor() as cur:
+        cur.execute(f"SET search_path = {SCHEMA}, public;")
+        t0 = time.perf_counter()
+        fn(cur)
+        secs = time.perf_counter() - t0
+    conn.rollback()
+    return secs
+
+
+def delete_batch(cur):
+    # mismas sentencias que db.delete_people_from_batch
+    cur.execute("SELECT person_id FROM import_batch_people WHERE batch_id=%s", (2,))
+    ids = [r[0] for r in cur.fetchall()]
+    cur.execute("DELETE FROM people WHERE id = ANY(%s)", (ids,))
+    cur.execute("DELETE FROM import_batch_people WHERE batch_id=%s", (2,))
+    cur.execute("DELETE FROM import_batch WHERE id=%s", (2,))
+
+
+def clear_slots(ids):
+    def run(cur):
+        # mismas sentencias que db.clear_attendance_slot, una persona a la vez
+        for pid in ids:
+            cur.execute("DELETE FROM assistance WHERE person_id=%s AND slot=%s", (pid, SLOTS[0]))
+            cur.execute(f"UPDATE attendance_slots SET {SLOTS[0]} = NULL WHERE person_id=%s", (pid,))
+    return run
+
+
+def audit_query(where, params):
+    def run(cur):
+        cur.execute(f"SELECT id, timestamp_utc, username, action FROM audit_log WHERE {where} "
+                    "ORDER BY timestamp_utc DESC LIMIT 2000", params)
+        cur.fetchall()
+    return run
+
+
+def main():
+    n_people = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    n_audit = int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            t0 = time.perf_counter()
+            populate(cur, n_people, n_audit)
+        conn.commit()
+        print(f"datos: {n_people} personas, {n_audit} eventos ({time.perf_counter() - t0:.1f} s)")
+
+        rnd = random.Random(7)
+        clear_ids = rnd.sample(range(1, n_people + 1), 1000)
+        cases = [
+            ("borrar lote (5000 personas)", delete_batch),
+            ("borrar marca x1000", clear_slots(clear_ids)),
+            ("auditoría: acción frecuente", audit_query("action = %s", ["clear_attendance"])),
+            ("auditoría: acción poco frecuente", audit_query("action = %s", ["delete_import_batch"])),
+            ("auditoría: usuario", audit_query("username = %s", ["auditor"])),
+            ("auditoría: usuario contiene", audit_query("username ILIKE %s", ["%audit%"])),
+        ]
+        before = [timed(conn, fn) for _, fn in cases]
+
+        with conn.cursor() as cur:
+            cur.execute(f"SET search_path = {SCHEMA}, public;")
+            for sql in SECONDARY_INDEXES:
+                cur.execute(sql)
+            cur.execute("ANALYZE;")
+        conn.commit()
+        after = [timed(conn, fn) for _, fn in cases]
+
+        print(f"{'operación':32} {'sin índices':>12} {'con índices':>12}")
+        for (name, _), b, a in zip(cases, before, after):
+            print(f"{name:32} {b * 1000:10.1f} ms {a * 1000:10.1f} ms   x{b / a:,.1f}")
+    finally:
+        conn.rollback()
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE;")
+        conn.commit()
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Benchmark de la normalización del importador: versión fila por fila
+(la que tenía routes/import_people) contra importer.normalize_people.
+
+    python bench/bench_normalize.py [filas]
+
+Genera un archivo sintético (por defecto 500k filas), verifica que ambas
+versiones den exactamente el mismo resultado y muestra filas/segundo.
+"""
+import os
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from importer import TARGET, guess, normalize_people  # noqa: E402
+
+
+# --- Implementación anterior (por fila), copiada tal cual como referencia ---
+def _norm_text(x):
+    if pd.isna(x): return ""
+    s = str(x).strip().replace("\u00a0"," ")
+    s = re.sub(r"\s+", " ", s)
+    return s
+
+def _only_digits(x):
+    return re.sub(r"\D", "", str(x or ""))
+
+def _clean_email(val: str) -> str:
+    s = str(val or "").upper().replace("ANONYMOUS", "").strip()
+    m = re.search(r"([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})", s)
+    return m.group(1) if m else ""
+
+def _to_upper(s: str) -> str:
+    return str(s or "").upper()
+
+def legacy_normalize(df, map_dest):
+    tmp = {}
+    for dest in TARGET:
+        cols = [src for src, d in map_dest.items() if d == dest]
+        if not cols:
+            tmp[dest] = ""
+        else:
+            tmp[dest] = df[cols].astype(str).apply(lambda r: " ".join([x for x in r if str(x).strip() and str(x).lower()!='nan']).strip(), axis=1)
+    people = pd.DataFrame({k: (tmp[k] if not isinstance(tmp[k], str) else pd.Series([""]*len(df))) for k in TARGET})
+    people["document"] = people["document"].apply(_only_digits)
+    people["phone"] = people["phone"].apply(_only_digits)
+    for col in ["region","department","municipality","names","email","position","entity"]:
+        people[col] = people[col].apply(_norm_text).apply(_to_upper)
+    people["names"] = people["names"].str.replace(r"\bNAN\b", "", regex=True).str.replace(r"\s+", " ", regex=True).str.strip()
+    people["email"] = people["email"].apply(_clean_email)
+    return people
+
+
+def synthetic(n: int, seed: int = 7) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    first = np.array(["José", "maría", " ANA ", "Luis", "nan", "", "Pedro\u00a0 Pablo"], dtype=object)
+    last = np.array(["Pérez", "gómez ", "DÍAZ", None, "Nan", "de la  Cruz"], dtype=object)
+    docs = rng.integers(1_000_000, 99_999_999, n).astype(str).astype(object)
+    fmt = rng.random(n)
+    docs = np.where(fmt < 0.3, np.char.add("C.C. ", docs.astype(str)), docs)
+    emails = np.where(rng.random(n) < 0.2, "anonymous", np.char.add(np.char.add("user", np.arange(n).astype(str)), "@Mail.com ")).astype(object)
+    return pd.DataFrame({
+        "Documento de identidad": docs,
+        "Nombres": first[rng.integers(0, len(first), n)],
+        "Apellidos": last[rng.integers(0, len(last), n)],
+        "Celular": rng.choice(np.array(["300 123 4567", "(+57) 310-000", "", None], dtype=object), n),
+        "Correo electrónico": emails,
+        "Entidad": rng.choice(np.array(["alcaldía  de x", "GOBERNACIÓN", None], dtype=object), n),
+        "Cargo": rng.choice(np.array(["secretario", " Jefe ", np.nan], dtype=object), n),
+        "Municipio": rng.choice(np.array(["Tunja", "sogamoso", "Duitama"], dtype=object), n),
+        "Provincia": rng.choice(np.array(["Centro", "Sugamuxi", ""], dtype=object), n),
+    })
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    df = synthetic(n)
+    mapping = {c: guess(c) for c in df.columns}
+
+    t0 = time.perf_counter()
+    # la versión anterior leía con pd.read_excel: las celdas vacías llegaban como NaN
+    old = legacy_normalize(df.where(df.notna(), np.nan), mapping)
+    t_old = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    new = normalize_people(df, mapping)
+    t_new = time.perf_counter() - t0
+
+    pd.testing.assert_frame_equal(old, new)
+    print(f"filas: {n}")
+    print(f"antes (fila por fila): {t_old:8.2f} s  {n / t_old:12,.0f} filas/s")
+    print(f"ahora (columnar):      {t_new:8.2f} s  {n / t_new:12,.0f} filas/s")
+    print(f"aceleración: x{t_old / t_new:.1f}  (resultados idénticos)")
+
+
+if __name__ == "__main__":
+    main()
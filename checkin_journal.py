@@ -0,0 +1,236 @@
+# checkin_journal.py
+"""
+Diario local de confirmaciones de asistencia (write-behind).
+
+Cada confirmación se escribe primero en un SQLite local (modo WAL) con una
+clave de idempotencia y se responde al operador de inmediato; un hilo la
+aplica después en Postgres por lotes (db.apply_checkins). Si la base no
+responde, las confirmaciones se acumulan aquí y se reintentan con espera
+creciente, también después de reiniciar la aplicación. Reenviar un lote ya
+aplicado no duplica nada (assistance.checkin_key, migración 9). Si varios
+procesos comparten el archivo, cada uno reclama sus filas antes de
+aplicarlas (claimed_by); un reclamo de un proceso que murió vence a los
+CHECKIN_CLAIM_TIMEOUT segundos y otro lo retoma.
+
+El archivo tiene que estar en un disco que sobreviva a los reinicios
+(CHECKIN_JOURNAL_PATH). El valor por defecto, junto al código, en Heroku es
+efímero: lo que siga pendiente al reiniciar el dyno se pierde. Sin la
+variable, status() devuelve persistent=False y el kiosco lo advierte; al
+apagar el proceso se intenta vaciar el diario (flush).
+"""
+import atexit
+import datetime
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+import db
+
+CHECKIN_JOURNAL_PATH = os.getenv(
+    "CHECKIN_JOURNAL_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkin_journal.sqlite3"),
+)
+JOURNAL_PERSISTENT = "CHECKIN_JOURNAL_PATH" in os.environ
+CHECKIN_BATCH = int(os.getenv("CHECKIN_BATCH", "500"))
+CHECKIN_FLUSH_INTERVAL = float(os.getenv("CHECKIN_FLUSH_INTERVAL", "0.5"))
+CHECKIN_KEEP_HOURS = float(os.getenv("CHECKIN_KEEP_HOURS", "24"))
+CHECKIN_CLAIM_TIMEOUT = float(os.getenv("CHECKIN_CLAIM_TIMEOUT", "120"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkins (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    document TEXT NOT NULL,
+    slot TEXT NOT NULL,
+    ts_utc TEXT NOT NULL,
+    user_id INTEGER,
+    username TEXT,
+    synced_at TEXT,
+    result TEXT,
+    claimed_by TEXT,
+    claimed_at REAL
+);
+CREATE INDEX IF NOT EXISTS checkins_pending ON checkins (seq) WHERE synced_at IS NULL;
+CREATE INDEX IF NOT EXISTS checkins_document ON checkins (document);
+"""
+
+_lock = threading.Lock()
+_conn = None
+_wake = threading.Event()
+_thread = None
+_state = {"online": None, "last_sync": None, "last_error": None, "synced": 0, "batches": 0}
+_last_prune = 0.0
+_owner = uuid.uuid4().hex  # identifica los reclamos de este proceso
+
+def _utcnow() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def _db() -> sqlite3.Connection:
+    """Conexión única del proceso; usar siempre con _lock tomado."""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(CHECKIN_JOURNAL_PATH, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(checkins)")}
+        for col, kind in (("claimed_by", "TEXT"), ("claimed_at", "REAL")):
+            if col not in cols:  # diarios creados antes de los reclamos
+                conn.execute(f"ALTER TABLE checkins ADD COLUMN {col} {kind}")
+        _conn = conn
+    return _conn
+
+def record(document: str, slot: str, user=None) -> str:
+    """Guarda una confirmación en el diario y devuelve su clave. No toca Postgres."""
+    if slot not in db.SLOTS:
+        raise ValueError("Slot inválido")
+    user = user or {}
+    key = uuid.uuid4().hex
+    with _lock:
+        _db().execute(
+            "INSERT INTO checkins (key, document, slot, ts_utc, user_id, username) VALUES (?,?,?,?,?,?)",
+            (key, document, slot, _utcnow(), user.get("id"), user.get("username")),
+        )
+    start()
+    _wake.set()
+    return key
+
+def results(keys) -> dict:
+    """{clave: resultado} de las claves ya aplicadas; las pendientes no aparecen."""
+    keys = list(keys)
+    if not keys:
+        return {}
+    with _lock:
+        rows = _db().execute(
+            f"SELECT key, result FROM checkins WHERE synced_at IS NOT NULL AND key IN ({','.join('?' * len(keys))})",
+            keys,
+        ).fetchall()
+    return dict(rows)
+
+def pending_for(document: str) -> dict:
+    """{slot: ts_utc} de las confirmaciones del documento que aún no se aplicaron."""
+    with _lock:
+        rows = _db().execute(
+            "SELECT slot, MIN(ts_utc) FROM checkins WHERE document=? AND synced_at IS NULL GROUP BY slot",
+            (document,),
+        ).fetchall()
+    return dict(rows)
+
+def status() -> dict:
+    """
+    Pendientes, estado de la conexión y última sincronización (para la UI).
+    persistent=False: el diario está en la ruta por defecto, que puede no
+    sobrevivir a un reinicio.
+    """
+    start()
+    with _lock:
+        pending = _db().execute("SELECT COUNT(*) FROM checkins WHERE synced_at IS NULL").fetchone()[0]
+        return dict(_state, pending=pending, persistent=JOURNAL_PERSISTENT)
+
+def offline() -> bool:
+    """True si el último intento de aplicar en Postgres falló (sin leer el diario)."""
+    return _state["online"] is False
+
+def flush(timeout: float = 10.0) -> bool:
+    """Espera a que el hilo vacíe el diario; False si quedó algo pendiente."""
+    if _conn is None:
+        return True
+    deadline = time.monotonic() + timeout
+    while True:
+        with _lock:
+            pending = _db().execute("SELECT COUNT(*) FROM checkins WHERE synced_at IS NULL").fetchone()[0]
+        if not pending:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        start()
+        _wake.set()
+        time.sleep(0.1)
+
+# Heroku manda SIGTERM y espera ~30 s antes de matar el dyno
+atexit.register(flush)
+
+def _prune():
+    global _last_prune
+    now = time.monotonic()
+    if now - _last_prune < 60:
+        return
+    _last_prune = now
+    cutoff = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=CHECKIN_KEEP_HOURS)).isoformat()
+    _db().execute("DELETE FROM checkins WHERE synced_at IS NOT NULL AND synced_at < ?", (cutoff,))
+
+def _claim() -> list:
+    """Reclama para este proceso un lote pendiente libre (o con reclamo vencido)."""
+    now = time.time()
+    with _lock:
+        return _db().execute(
+            "UPDATE checkins SET claimed_by=?, claimed_at=? WHERE seq IN ("
+            "  SELECT seq FROM checkins WHERE synced_at IS NULL"
+            "  AND (claimed_by IS NULL OR claimed_by=? OR claimed_at < ?)"
+            "  ORDER BY seq LIMIT ?"
+            ") RETURNING key, document, slot, ts_utc, user_id, username",
+            (_owner, now, _owner, now - CHECKIN_CLAIM_TIMEOUT, CHECKIN_BATCH),
+        ).fetchall()
+
+def flush_once() -> int:
+    """Aplica un lote pendiente en Postgres; devuelve cuántas confirmaciones aplicó."""
+    rows = _claim()
+    if not rows:
+        return 0
+    try:
+        applied = db.apply_checkins(rows)
+    except Exception:
+        with _lock:
+            _db().executemany(
+                "UPDATE checkins SET claimed_by=NULL WHERE key=? AND claimed_by=?",
+                [(r[0], _owner) for r in rows],
+            )
+        raise
+    now = _utcnow()
+    with _lock:
+        conn = _db()
+        conn.execute("BEGIN")
+        # synced_at IS NULL: si otro proceso retomó el reclamo vencido y ya
+        # lo aplicó, su resultado (no el 'ok' de la repetición) es el que vale
+        conn.executemany(
+            "UPDATE checkins SET synced_at=?, result=? WHERE key=? AND synced_at IS NULL",
+            [(now, applied.get(r[0], "ok"), r[0]) for r in rows],
+        )
+        conn.execute("COMMIT")
+        _state["synced"] += len(rows)
+        _state["batches"] += 1
+        _prune()
+    return len(rows)
+
+def _flusher():
+    backoff = 1.0
+    while True:
+        _wake.wait(CHECKIN_FLUSH_INTERVAL)
+        _wake.clear()
+        try:
+            n = flush_once()
+            if n == CHECKIN_BATCH:  # quedó cola: seguir sin esperar
+                while flush_once():
+                    pass
+            if n:
+                with _lock:
+                    _state.update(online=True, last_sync=time.time(), last_error=None)
+            backoff = 1.0
+        except Exception as ex:
+            with _lock:
+                _state.update(online=False, last_error=str(ex))
+            time.sleep(backoff)  # sin conexión: no reintentar en cada escaneo
+            backoff = min(backoff * 2, 30.0)
+
+def start():
+    """Arranca el hilo que vacía el diario (también aplica lo que quedó de antes)."""
+    global _thread
+    if _thread is not None and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_flusher, name="checkin-journal", daemon=True)
+            _thread.start()
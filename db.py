@@ -1,11 +1,24 @@
-
+import atexit
+import csv
+import datetime
+import io
+import logging
 import os
+import queue
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 import bcrypt
 import psycopg2
+from psycopg2 import pool as pg_pool
 from psycopg2.extras import execute_values, Json
 from urllib.parse import urlparse
 import pandas as pd
 
+_log = logging.getLogger(__name__)
+
 SLOTS = [
     "registro_dia1_manana",
     "registro_dia1_tarde",
@@ -13,120 +26,213 @@ SLOTS = [
     "registro_dia2_tarde",
 ]
 
-def get_connection():
+# Sin esto, con la base caída cada intento espera el timeout TCP del sistema
+# (minutos) antes de fallar.
+CONNECT_TIMEOUT = int(os.environ.get("DB_CONNECT_TIMEOUT", "5"))
+
+def _connect_kwargs():
     url = os.environ.get("DATABASE_URL")
     if not url:
-        host = os.environ.get("DB_HOST","127.0.0.1")
-        user = os.environ.get("DB_USER","postgres")
-        password = os.environ.get("DB_PASSWORD","")
-        dbname = os.environ.get("DB_NAME","sistema_asistencia")
-        port = int(os.environ.get("DB_PORT","5432"))
-        sslmode = os.environ.get("DB_SSLMODE","prefer")
-        return psycopg2.connect(host=host, user=user, password=password, dbname=dbname, port=port, sslmode=sslmode)
-    else:
-        result = urlparse(url)
-        sslmode = "require" if (result.hostname or "").endswith("amazonaws.com") else os.environ.get("DB_SSLMODE","prefer")
-        return psycopg2.connect(
-            dbname=result.path[1:],
-            user=result.username,
-            password=result.password,
-            host=result.hostname,
-            port=result.port or 5432,
-            sslmode=sslmode
+        return dict(
+            host=os.environ.get("DB_HOST","127.0.0.1"),
+            user=os.environ.get("DB_USER","postgres"),
+            password=os.environ.get("DB_PASSWORD",""),
+            dbname=os.environ.get("DB_NAME","sistema_asistencia"),
+            port=int(os.environ.get("DB_PORT","5432")),
+            sslmode=os.environ.get("DB_SSLMODE","prefer"),
+            connect_timeout=CONNECT_TIMEOUT,
         )
+    result = urlparse(url)
+    sslmode = "require" if (result.hostname or "").endswith("amazonaws.com") else os.environ.get("DB_SSLMODE","prefer")
+    return dict(
+        dbname=result.path[1:],
+        user=result.username,
+        password=result.password,
+        host=result.hostname,
+        port=result.port or 5432,
+        sslmode=sslmode,
+        connect_timeout=CONNECT_TIMEOUT,
+    )
 
-def init_database():
-    conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            try:
-                cur.execute("CREATE EXTENSION IF NOT EXISTS unaccent;")
-            except Exception:
-                pass
-            cur.execute("""CREATE TABLE IF NOT EXISTS people (
-              id SERIAL PRIMARY KEY,
-              region VARCHAR(255),
-              department VARCHAR(255),
-              municipality VARCHAR(255),
-              document VARCHAR(50) UNIQUE NOT NULL,
-              names VARCHAR(255) NOT NULL,
-              phone VARCHAR(50),
-              email VARCHAR(255),
-              position VARCHAR(255),
-              entity VARCHAR(255)
-            );""" )
-            cur.execute("""CREATE TABLE IF NOT EXISTS assistance (
-              id SERIAL PRIMARY KEY,
-              person_id INT NOT NULL REFERENCES people(id) ON DELETE CASCADE,
-              timestamp_utc TIMESTAMP DEFAULT NOW(),
-              slot TEXT
-            );""" )
-            cur.execute("""DO $$
-            BEGIN
-              IF NOT EXISTS (
-                SELECT 1 FROM information_schema.check_constraints
-                WHERE constraint_name = 'assistance_slot_check'
-              ) THEN
-                ALTER TABLE assistance
-                ADD CONSTRAINT assistance_slot_check
-                CHECK (slot IN ('registro_dia1_manana','registro_dia1_tarde','registro_dia2_manana','registro_dia2_tarde'));
-              END IF;
-            END$$;""" )
-            cur.execute("""CREATE TABLE IF NOT EXISTS users (
-              id SERIAL PRIMARY KEY,
-              username VARCHAR(100) UNIQUE NOT NULL,
-              password_hash VARCHAR(200) NOT NULL,
-              is_admin BOOLEAN NOT NULL DEFAULT FALSE,
-              is_active BOOLEAN NOT NULL DEFAULT TRUE,
-              created_at TIMESTAMP DEFAULT NOW()
-            );""" )
-            cur.execute("""CREATE TABLE IF NOT EXISTS attendance_slots (
-              person_id INT PRIMARY KEY REFERENCES people(id) ON DELETE CASCADE,
-              registro_dia1_manana TIMESTAMP NULL,
-              registro_dia1_tarde  TIMESTAMP NULL,
-              registro_dia2_manana TIMESTAMP NULL,
-              registro_dia2_tarde  TIMESTAMP NULL
-            );""" )
-            cur.execute("""CREATE TABLE IF NOT EXISTS settings (
-              key TEXT PRIMARY KEY,
-              value TEXT NOT NULL
-            );""" )
-            cur.execute("""INSERT INTO settings(key, value)
-            VALUES ('active_slot', 'registro_dia1_manana')
-            ON CONFLICT (key) DO NOTHING;""" )
-    ensure_audit_table()
-
-def ensure_default_admin():
+def get_connection():
+    """Conexión nueva, fuera del pool. El llamador debe cerrarla.
+    Para el trabajo normal usar `connection()`."""
+    return psycopg2.connect(**_connect_kwargs())
+
+
+# === Pool de conexiones (compartido por todo el proceso) ===
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", "1"))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "10"))
+# Si una conexión estuvo ociosa más de N segundos se verifica con SELECT 1 al sacarla
+POOL_PING_AFTER = float(os.environ.get("DB_POOL_PING_AFTER", "30"))
+
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(POOL_MAX)
+_idle = []          # conexiones ociosas; se reutiliza la última devuelta
+_in_use = 0
+_pool_warm = False  # ya se abrieron las POOL_MIN iniciales
+_last_used = {}
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "waits": 0,
+    "wait_ms": 0.0,
+    "connects": 0,
+    "handshake_ms": 0.0,
+    "discarded": 0,
+}
+
+def _bump(key, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+def _new_connection():
+    """Conexión nueva para el pool; mide el handshake."""
+    t0 = time.perf_counter()
     conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM users;")
-            count = cur.fetchone()[0]
-            if count == 0:
-                username = "admin"
-                password = "Admin2025!"
-                hash_ = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-                cur.execute("INSERT INTO users (username, password_hash, is_admin, is_active) VALUES (%s, %s, TRUE, TRUE);", (username, hash_))
+    _bump("connects")
+    _bump("handshake_ms", (time.perf_counter() - t0) * 1000.0)
+    _last_used[id(conn)] = time.monotonic()
+    return conn
+
+def _discard(conn):
+    _bump("discarded")
+    _last_used.pop(id(conn), None)
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+def _warm_pool():
+    global _pool_warm
+    if _pool_warm:
+        return
+    with _pool_lock:
+        if _pool_warm:
+            return
+        _pool_warm = True
+    fresh = [_new_connection() for _ in range(POOL_MIN)]
+    with _pool_lock:
+        _idle.extend(fresh)
+
+def _healthy(conn) -> bool:
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0.0) > POOL_PING_AFTER:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+def _checkout():
+    global _in_use
+    if not _pool_slots.acquire(blocking=False):
+        t0 = time.perf_counter()
+        _bump("waits")
+        ok = _pool_slots.acquire(timeout=POOL_TIMEOUT)
+        _bump("wait_ms", (time.perf_counter() - t0) * 1000.0)
+        if not ok:
+            raise pg_pool.PoolError(f"Sin conexiones libres tras {POOL_TIMEOUT:.0f}s (DB_POOL_MAX={POOL_MAX})")
+    try:
+        _warm_pool()
+        # Tras una caída de la base todas las ociosas están muertas: se
+        # descartan hasta encontrar una sana o quedarse sin, y se abre una nueva.
+        while True:
+            with _pool_lock:
+                conn = _idle.pop() if _idle else None
+            if conn is None:
+                conn = _new_connection()
+                break
+            if _healthy(conn):
+                break
+            _discard(conn)
+    except Exception:
+        _pool_slots.release()
+        raise
+    with _pool_lock:
+        _in_use += 1
+    _bump("checkouts")
+    return conn
+
+def _checkin(conn, broken=False):
+    global _in_use
+    try:
+        if broken or conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            _discard(conn)
+        else:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            _last_used[id(conn)] = time.monotonic()
+            with _pool_lock:
+                _idle.append(conn)
+    finally:
+        with _pool_lock:
+            _in_use -= 1
+        _pool_slots.release()
+
+@contextmanager
+def connection():
+    """
+    Saca una conexión del pool y la devuelve al terminar.
+    Commit si el bloque termina bien, rollback si lanza excepción.
+    """
+    conn = _checkout()
+    broken = False
+    try:
+        with conn:
+            yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        _checkin(conn, broken=broken)
+
+def pool_stats() -> dict:
+    """Contadores del pool: esperas, conexiones nuevas y tiempo de handshake (ms)."""
+    with _stats_lock:
+        out = dict(_stats)
+    with _pool_lock:
+        out["in_use"] = _in_use
+        out["idle"] = len(_idle)
+    out["max"] = POOL_MAX
+    return out
+
+def close_pool():
+    """Cierra las conexiones ociosas del proceso."""
+    global _pool_warm
+    with _pool_lock:
+        idle = _idle[:]
+        _idle.clear()
+        _pool_warm = False
+    for conn in idle:
+        _last_used.pop(id(conn), None)
+        conn.close()
 
 def get_user(username):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, username, password_hash, is_admin, is_active FROM users WHERE username=%s", (username,))
-        return cur.fetchone()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, username, password_hash, is_admin, is_active FROM users WHERE username=%s", (username,))
+            return cur.fetchone()
 
 def list_users():
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, username, is_admin, is_active, created_at FROM users ORDER BY id ASC")
-        return cur.fetchall()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, username, is_admin, is_active, created_at FROM users ORDER BY id ASC")
+            return cur.fetchall()
 
 def create_user(username, password, is_admin=False, is_active=True):
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
-            hash_ = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-            cur.execute("INSERT INTO users (username, password_hash, is_admin, is_active) VALUES (%s, %s, %s, %s) RETURNING id;", (username, hash_, is_admin, is_active))
-            return cur.fetchone()[0]
+            cur.execute("INSERT INTO users (username, password_hash, is_admin, is_active) VALUES (%s, %s, %s, %s) RETURNING id;", (username, hash_password(password), is_admin, is_active))
+            uid = cur.fetchone()[0]
+    forget_user(username)
+    return uid
 
 def update_user(user_id, username=None, is_admin=None, is_active=None, password=None):
     sets = []
@@ -138,20 +244,18 @@ def update_user(user_id, username=None, is_admin=None, is_active=None, password=
     if is_active is not None:
         sets.append("is_active=%s"); params.append(is_active)
     if password is not None and password.strip():
-        hash_ = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-        sets.append("password_hash=%s"); params.append(hash_)
+        sets.append("password_hash=%s"); params.append(hash_password(password))
     if not sets:
         return
     params.append(user_id)
     sql = "UPDATE users SET " + ", ".join(sets) + " WHERE id=%s"
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute(sql, tuple(params))
+    forget_user()
 
 def delete_user(user_id):
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT username FROM users WHERE id=%s", (user_id,))
             row = cur.fetchone()
@@ -159,41 +263,148 @@ def delete_user(user_id):
             if row[0] == "admin":
                 raise ValueError("No se puede eliminar el usuario por defecto 'admin'.")
             cur.execute("DELETE FROM users WHERE id=%s", (user_id,))
+    forget_user(row[0])
+
+# === Valores de filtros (facetas) con cache en proceso ===
+FACET_COLUMNS = ("region", "department", "municipality", "entity")
+FACET_TTL = float(os.environ.get("FACET_CACHE_TTL", "300"))
+
+_facet_lock = threading.Lock()
+_people_version = 0
+_facet_cache = None  # (version, expira, {columna: [(valor, cantidad), ...]})
+
+def _people_changed():
+    """Invalida las facetas; llamar después del commit de cualquier cambio en people."""
+    global _people_version
+    with _facet_lock:
+        _people_version += 1
+
+def facet_counts():
+    """
+    {columna: [(valor, cantidad), ...]} para region/department/municipality/entity,
+    ordenado por valor. Un solo recorrido de people (GROUPING SETS), cacheado hasta
+    que cambie people en este proceso o venza FACET_CACHE_TTL (otros workers).
+    """
+    global _facet_cache
+    with _facet_lock:
+        version = _people_version
+        cached = _facet_cache
+    if cached and cached[0] == version and cached[1] > time.monotonic():
+        return cached[2]
+    sets = ", ".join(f"({c})" for c in FACET_COLUMNS)
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT {', '.join(FACET_COLUMNS)}, COUNT(*) FROM people GROUP BY GROUPING SETS ({sets})"
+            )
+            rows = cur.fetchall()
+    out = {c: [] for c in FACET_COLUMNS}
+    for r in rows:
+        for i, c in enumerate(FACET_COLUMNS):
+            if r[i] is not None and r[i] != "":
+                out[c].append((r[i], r[-1]))
+                break
+    for c in FACET_COLUMNS:
+        out[c].sort(key=lambda t: t[0])
+    with _facet_lock:
+        # si people cambió mientras consultábamos, no guardamos un resultado viejo
+        if _people_version == version:
+            _facet_cache = (version, time.monotonic() + FACET_TTL, out)
+    return out
 
 def distinct_values(column):
-    assert column in ("region","department","municipality","entity")
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute(f"SELECT DISTINCT {column} FROM people WHERE {column} IS NOT NULL AND {column}<>'' ORDER BY {column}")
-        return [r[0] for r in cur.fetchall()]
+    assert column in FACET_COLUMNS
+    return [v for v, _ in facet_counts()[column]]
 
-def search_people_with_slots(q="", regions=None, municipalities=None, entities=None, limit=1000):
-    regions = regions or []
-    municipalities = municipalities or []
-    entities = entities or []
-    conn = get_connection()
-    sql = (
-        "SELECT p.id, p.region, p.department, p.municipality, p.document, p.names, p.phone, p.email, p.position, p.entity, "
-        "s.registro_dia1_manana, s.registro_dia1_tarde, s.registro_dia2_manana, s.registro_dia2_tarde "
-        "FROM people p LEFT JOIN attendance_slots s ON s.person_id = p.id WHERE 1=1"
-    )
+PEOPLE_SLOTS_SELECT = (
+    "SELECT p.id, p.region, p.department, p.municipality, p.document, p.names, p.phone, p.email, p.position, p.entity, "
+    "s.registro_dia1_manana, s.registro_dia1_tarde, s.registro_dia2_manana, s.registro_dia2_tarde "
+    "FROM people p LEFT JOIN attendance_slots s ON s.person_id = p.id"
+)
+PEOPLE_SLOTS_COLUMNS = [
+    "id","region","department","municipality","document","names","phone","email","position","entity",
+    *SLOTS,
+]
+
+def _people_filter(q="", regions=None, municipalities=None, entities=None):
+    """WHERE (sin la palabra) y parámetros comunes a búsqueda, paginación y exportación."""
+    sql = "1=1"
     params = []
     if q:
-        sql += " AND (unaccent(lower(p.names)) LIKE unaccent(lower(%s)) OR p.document ILIKE %s)"
-        like = f"%{q}%"; params.extend([like, like])
+        like_q = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        if q.isdigit():
+            # Solo dígitos: documento exacto o por prefijo (índice varchar_pattern_ops)
+            sql += " AND p.document LIKE %s"; params.append(f"{like_q}%")
+        else:
+            # Índices GIN trigram sobre norm_text(names) y document
+            sql += " AND (norm_text(p.names) LIKE norm_text(%s) OR p.document ILIKE %s)"
+            like = f"%{like_q}%"; params.extend([like, like])
     if regions:
-        sql += " AND p.region = ANY(%s)"; params.append(regions)
+        sql += " AND p.region = ANY(%s)"; params.append(list(regions))
     if municipalities:
-        sql += " AND p.municipality = ANY(%s)"; params.append(municipalities)
+        sql += " AND p.municipality = ANY(%s)"; params.append(list(municipalities))
     if entities:
-        sql += " AND p.entity = ANY(%s)"; params.append(entities)
-    sql += " ORDER BY p.id DESC LIMIT %s"; params.append(limit)
-    with conn.cursor() as cur:
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description]
+        sql += " AND p.entity = ANY(%s)"; params.append(list(entities))
+    return sql, params
+
+def search_people_with_slots(q="", regions=None, municipalities=None, entities=None, limit=1000):
+    where, params = _people_filter(q, regions, municipalities, entities)
+    sql = f"{PEOPLE_SLOTS_SELECT} WHERE {where} ORDER BY p.id DESC LIMIT %s"
+    params.append(limit)
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+            cols = [d[0] for d in cur.description]
     return pd.DataFrame(rows, columns=cols)
 
+def search_people_page(q="", regions=None, municipalities=None, entities=None, after_id=None, page_size=200):
+    """
+    Paginación por keyset sobre p.id (descendente): pasar como after_id el
+    último id de la página anterior. Devuelve (DataFrame, next_after_id);
+    next_after_id es None en la última página.
+    """
+    where, params = _people_filter(q, regions, municipalities, entities)
+    if after_id is not None:
+        where += " AND p.id < %s"; params.append(int(after_id))
+    sql = f"{PEOPLE_SLOTS_SELECT} WHERE {where} ORDER BY p.id DESC LIMIT %s"
+    params.append(page_size + 1)  # una fila extra para saber si hay siguiente
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    df = pd.DataFrame(rows, columns=PEOPLE_SLOTS_COLUMNS)
+    return df, (rows[-1][0] if has_next and rows else None)
+
+def iter_query(sql, params=None, itersize=5000):
+    """
+    Ejecuta `sql` con un cursor con nombre (server-side) y genera lotes de
+    hasta `itersize` tuplas; la memoria no depende del total de filas.
+    """
+    with connection() as conn:
+        with conn.cursor(name="iter_query") as cur:
+            cur.itersize = itersize
+            cur.execute(sql, params)
+            while True:
+                rows = cur.fetchmany(itersize)
+                if not rows:
+                    break
+                yield rows
+
+def copy_query_csv(sql, params, fileobj):
+    """Vuelca el resultado de `sql` como CSV (sin encabezado) con COPY ... TO STDOUT."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            query = cur.mogrify(sql, params).decode(psycopg2.extensions.encodings[conn.encoding])
+            cur.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", fileobj)
+
+def people_export_query(q="", regions=None, municipalities=None, entities=None):
+    """(sql, params) del resultado completo filtrado, en el orden de PEOPLE_SLOTS_COLUMNS."""
+    where, params = _people_filter(q, regions, municipalities, entities)
+    return f"{PEOPLE_SLOTS_SELECT} WHERE {where} ORDER BY p.id DESC", params
+
 UPSERT_PEOPLE_SQL = """
 INSERT INTO people (region, department, municipality, document, names, phone, email, position, entity)
 VALUES %s
@@ -212,48 +423,131 @@ SET
 def upsert_people_bulk(rows):
     if not rows:
         return 0
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             execute_values(cur, UPSERT_PEOPLE_SQL, rows, page_size=1000)
-            return cur.rowcount
+            count = cur.rowcount
+    _people_changed()
+    return count
+
+# === Configuración (settings) con cache en proceso ===
+# Los valores se leen una vez y quedan en memoria para todas las sesiones.
+# Un hilo escucha NOTIFY settings_changed (trigger de la migración 4) y vacía
+# el cache: un cambio hecho desde cualquier worker se ve al instante, sin
+# consultar la tabla en cada rerun. Mientras el hilo no está escuchando
+# (arranque, reconexión) se lee directo de la tabla. El mismo hilo atiende
+# attendance_changed (contadores del tablero, migración 8).
+SETTINGS_CHANNEL = "settings_changed"
+ATTENDANCE_CHANNEL = "attendance_changed"
+USERS_CHANNEL = "users_changed"
+
+_settings_lock = threading.Lock()
+_settings_version = 0
+_settings_cache = None  # {key: value}
+_listening = False
+_listener_thread = None
+
+def _settings_changed():
+    global _settings_version, _settings_cache
+    with _settings_lock:
+        _settings_version += 1
+        _settings_cache = None
+
+def _notify_listener():
+    global _listening
+    handlers = {
+        SETTINGS_CHANNEL: _settings_changed,
+        ATTENDANCE_CHANNEL: _counters_changed,
+        USERS_CHANNEL: forget_user,
+    }
+    backoff = 1.0
+    while True:
+        conn = None
+        try:
+            conn = get_connection()
+            conn.set_session(autocommit=True)
+            with conn.cursor() as cur:
+                for channel in handlers:
+                    cur.execute(f"LISTEN {channel};")
+            for fn in handlers.values():
+                fn()  # lo que haya cambiado mientras no escuchábamos
+            _listening = True
+            backoff = 1.0
+            while True:
+                if not select.select([conn], [], [], 30)[0]:
+                    # sin tráfico: comprobar que la conexión sigue viva
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1;")
+                conn.poll()
+                if conn.notifies:
+                    channels = {n.channel for n in conn.notifies}
+                    conn.notifies.clear()
+                    for channel in channels:
+                        handlers.get(channel, lambda: None)()
+        except Exception:
+            pass
+        finally:
+            _listening = False
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+        time.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+def _start_listener():
+    global _listener_thread
+    if _listener_thread is not None and _listener_thread.is_alive():
+        return
+    with _settings_lock:
+        if _listener_thread is None or not _listener_thread.is_alive():
+            _listener_thread = threading.Thread(target=_notify_listener, name="notify-listener", daemon=True)
+            _listener_thread.start()
+
+def get_settings() -> dict:
+    """{key: value} de la tabla settings, desde el cache del proceso."""
+    global _settings_cache
+    _start_listener()
+    with _settings_lock:
+        cached = _settings_cache
+        version = _settings_version
+    if cached is not None and _listening:
+        return cached
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT key, value FROM settings")
+            values = dict(cur.fetchall())
+    with _settings_lock:
+        # si llegó un NOTIFY durante la consulta, no guardar lo leído
+        if _settings_version == version:
+            _settings_cache = values
+    return values
 
 def get_active_slot():
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT value FROM settings WHERE key='active_slot'")
-        row = cur.fetchone()
-    return row[0] if row else SLOTS[0]
+    return get_settings().get("active_slot", SLOTS[0])
+
+def set_setting(key: str, value: str):
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("INSERT INTO settings(key, value) VALUES (%s, %s) ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value", (key, value))
+    _settings_changed()  # este proceso no espera al NOTIFY
 
 def set_active_slot(slot: str):
     if slot not in SLOTS:
         raise ValueError("Slot inválido")
-    conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO settings(key, value) VALUES ('active_slot', %s) ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value", (slot,))
+    set_setting("active_slot", slot)
 
 def ensure_attendance_slots(person_id: int):
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("INSERT INTO attendance_slots(person_id) VALUES (%s) ON CONFLICT (person_id) DO NOTHING", (person_id,))
 
-def mark_attendance_for_slot(person_id: int, slot: str):
-    if slot not in SLOTS:
-        raise ValueError("Slot inválido")
-    conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute("INSERT INTO assistance (person_id, slot) VALUES (%s, %s) RETURNING id", (person_id, slot))
-            ensure_attendance_slots(person_id)
-            cur.execute(f"UPDATE attendance_slots SET {slot} = COALESCE({slot}, NOW()) WHERE person_id = %s", (person_id,))
-
 def get_attendance_status(person_id: int):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT registro_dia1_manana, registro_dia1_tarde, registro_dia2_manana, registro_dia2_tarde FROM attendance_slots WHERE person_id=%s", (person_id,))
-        row = cur.fetchone()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT registro_dia1_manana, registro_dia1_tarde, registro_dia2_manana, registro_dia2_tarde FROM attendance_slots WHERE person_id=%s", (person_id,))
+            row = cur.fetchone()
     if not row:
         return {k: None for k in SLOTS}
     return dict(zip(SLOTS, row))
@@ -261,163 +555,758 @@ def get_attendance_status(person_id: int):
 def clear_attendance_slot(person_id: int, slot: str):
     if slot not in SLOTS:
         raise ValueError("Slot inválido")
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM assistance WHERE person_id=%s AND slot=%s", (person_id, slot))
             cur.execute(f"UPDATE attendance_slots SET {slot} = NULL WHERE person_id=%s", (person_id,))
             return cur.rowcount
 
-def ensure_audit_table():
-    conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute("""CREATE TABLE IF NOT EXISTS audit_log (
-                id SERIAL PRIMARY KEY,
-                timestamp_utc TIMESTAMP DEFAULT NOW(),
-                user_id INT,
-                username TEXT,
-                action TEXT NOT NULL,
-                person_id INT,
-                slot TEXT,
-                details JSONB
-            );""" )
-            cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(timestamp_utc DESC);")
-
-def log_action(user_id, username, action, person_id=None, slot=None, details=None):
-    conn = get_connection()
-    with conn:
+# === Certificados desde la asistencia (certificate_summary, migración 6) ===
+# Triggers sobre people y attendance_slots mantienen el porcentaje por
+# persona; aquí solo se lee por documento (PK) o por porcentaje.
+def certificate_lookup(document: str):
+    """(nombre, porcentaje) del documento, o None si no está registrado."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT names, percent FROM certificate_summary WHERE document=%s", (document,))
+            row = cur.fetchone()
+    return (row[0], float(row[1])) if row else None
+
+def certificate_eligible(min_percent: float = 75):
+    """[(documento, nombre)] de quienes alcanzan min_percent."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT document, names FROM certificate_summary WHERE percent >= %s ORDER BY document",
+                (min_percent,)
+            )
+            return cur.fetchall()
+
+def certificate_stats(min_percent: float = 75):
+    """(personas, habilitadas)."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT COUNT(*), COUNT(*) FILTER (WHERE percent >= %s) FROM certificate_summary",
+                (min_percent,)
+            )
+            return cur.fetchone()
+
+# === Registro de certificados cargado desde Excel (migración 7) ===
+# Cada carga es una versión nueva (COPY a una tabla temporal y de ahí a
+# certificate_registry); la versión activa se cambia en la misma transacción
+# vía settings, así los lectores ven la anterior completa o la nueva completa.
+CERT_REGISTRY_KEEP = 2  # versiones que se conservan (la activa y la anterior)
+
+def certificate_registry_version():
+    """Versión activa del registro, o None si nunca se cargó uno."""
+    v = get_settings().get("cert_registry_version")
+    return int(v) if v else None
+
+def load_certificate_registry(rows, username=None, content_hash=None):
+    """
+    rows: tuplas (documento, nombre, porcentaje). Si un documento se repite
+    queda la primera fila. Devuelve (versión, filas cargadas).
+    """
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO audit_log(user_id, username, action, person_id, slot, details) VALUES (%s,%s,%s,%s,%s,%s)",
-                (user_id, username, action, person_id, slot, Json(details) if details is not None else None)
+                "CREATE TEMP TABLE cert_stage (n BIGSERIAL, document TEXT, names TEXT, percent TEXT) ON COMMIT DROP;"
+                "INSERT INTO certificate_registry_version (username, content_hash) VALUES (%s, %s) RETURNING version;",
+                (username, content_hash)
+            )
+            version = cur.fetchone()[0]
+            cur.copy_expert("COPY cert_stage (document, names, percent) FROM STDIN WITH (FORMAT csv)", _rows_csv(rows))
+            cur.execute(
+                """INSERT INTO certificate_registry (version, document, names, percent)
+                SELECT DISTINCT ON (document) %s, document, names, COALESCE(NULLIF(percent, '')::numeric, 0)
+                FROM cert_stage WHERE document <> ''
+                ORDER BY document, n""",
+                (version,)
+            )
+            count = cur.rowcount
+            cur.execute("UPDATE certificate_registry_version SET rows=%s WHERE version=%s", (count, version))
+            cur.execute(
+                "INSERT INTO settings(key, value) VALUES ('cert_registry_version', %s) "
+                "ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value",
+                (str(version),)
             )
+            cur.execute("DELETE FROM certificate_registry_version WHERE version <= %s", (version - CERT_REGISTRY_KEEP,))
+    _settings_changed()
+    return version, count
+
+def certificate_registry_rows(version: int):
+    """[(documento, nombre, porcentaje)] de una versión del registro."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT document, names, percent::float8 FROM certificate_registry WHERE version=%s", (version,))
+            return cur.fetchall()
+
+# === Tablero: contadores de asistencia (attendance_counters, migración 8) ===
+# Los triggers mantienen (momento, provincia, entidad) -> personas y avisan por
+# NOTIFY attendance_changed; el hilo de _notify_listener sube la versión y el
+# siguiente lector recarga. Varios tableros abiertos = una consulta por cambio.
+_counters_lock = threading.Lock()
+_counters_version = 0
+_counters_cache = None  # (versión, filas)
+
+def _counters_changed():
+    global _counters_version
+    with _counters_lock:
+        _counters_version += 1
+
+def counters_version() -> int:
+    """Cambia cada vez que llega un aviso de asistencia (barato, sin consultas)."""
+    _start_listener()
+    return _counters_version if _listening else -1
+
+def attendance_counters():
+    """[(momento, provincia, entidad, personas)]; incluye la fila 'registrados'."""
+    global _counters_cache
+    _start_listener()
+    with _counters_lock:
+        version = _counters_version
+        cached = _counters_cache
+    if cached is not None and cached[0] == version and _listening:
+        return cached[1]
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT slot, region, entity, n FROM attendance_counters WHERE n <> 0")
+            rows = cur.fetchall()
+    with _counters_lock:
+        if _counters_version == version:
+            _counters_cache = (version, rows)
+    return rows
+
+def rebuild_attendance_counters():
+    """Recalcula los contadores desde cero (p. ej. después de un TRUNCATE manual)."""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT rebuild_attendance_counters(); NOTIFY attendance_changed;")
+
+# === Operaciones masivas (selección de Buscar) ===
+# Devuelven {person_id: resultado}; resultado "ok" o el motivo del fallo.
+def mark_attendance_bulk(ids, slot: str):
+    if slot not in SLOTS:
+        raise ValueError("Slot inválido")
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return {}
+    sql = (
+        "WITH ok AS ("
+        "  SELECT id FROM people WHERE id = ANY(%(ids)s)"
+        "), a AS ("
+        "  INSERT INTO assistance (person_id, slot) SELECT id, %(slot)s FROM ok RETURNING person_id, timestamp_utc"
+        "), s AS ("
+        f"  INSERT INTO attendance_slots (person_id, {slot}) SELECT person_id, timestamp_utc FROM a"
+        f"  ON CONFLICT (person_id) DO UPDATE SET {slot} = COALESCE(attendance_slots.{slot}, EXCLUDED.{slot})"
+        "  RETURNING person_id"
+        ") SELECT person_id FROM s"
+    )
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, {"ids": ids, "slot": slot})
+            done = {r[0] for r in cur.fetchall()}
+    return {pid: ("ok" if pid in done else "no existe") for pid in ids}
+
+def clear_attendance_bulk(ids, slot: str):
+    if slot not in SLOTS:
+        raise ValueError("Slot inválido")
+    ids = sorted({int(i) for i in ids})
+    if not ids:
+        return {}
+    sql = (
+        "WITH d AS ("
+        "  DELETE FROM assistance WHERE person_id = ANY(%(ids)s) AND slot = %(slot)s"
+        "), u AS ("
+        f"  UPDATE attendance_slots SET {slot} = NULL"
+        f"  WHERE person_id = ANY(%(ids)s) AND {slot} IS NOT NULL RETURNING person_id"
+        ") SELECT p.id, (u.person_id IS NOT NULL) FROM people p"
+        " LEFT JOIN u ON u.person_id = p.id WHERE p.id = ANY(%(ids)s)"
+    )
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, {"ids": ids, "slot": slot})
+            found = dict(cur.fetchall())
+    out = {}
+    for pid in ids:
+        if pid not in found:
+            out[pid] = "no existe"
+        else:
+            out[pid] = "ok" if found[pid] else "sin registro"
+    return out
+
+# === Auditoría: escritor en segundo plano ===
+# log_action / log_actions_bulk encolan las filas y un hilo las escribe por
+# lotes (execute_values), fuera del camino de cada clic. La hora del evento se
+# toma al encolar. Las acciones de AUDIT_DURABLE_ACTIONS (o durable=True) se
+# escriben en el momento, como antes. La cola tiene tope: si se llena (base
+# caída mucho tiempo) los eventos nuevos se descartan y se cuentan en
+# audit_stats(). Al salir del proceso se vacía la cola (atexit).
+AUDIT_QUEUE_MAX = int(os.environ.get("AUDIT_QUEUE_MAX", "10000"))
+AUDIT_BATCH = int(os.environ.get("AUDIT_BATCH", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.5"))
+AUDIT_RETRIES = 5
+AUDIT_TRANSIENT = (psycopg2.OperationalError, pg_pool.PoolError)  # se reintentan
+# Las particiones mensuales se crean AUDIT_MONTHS_AHEAD meses adelante al
+# migrar; un proceso que corre más que eso las necesita también después.
+AUDIT_PARTITION_CHECK = 24 * 3600
+AUDIT_DURABLE_ACTIONS = {"delete_people_bulk", "delete_import_batch", "import_people"}
+
+AUDIT_INSERT_SQL = (
+    "INSERT INTO audit_log(timestamp_utc, user_id, username, action, person_id, slot, details) VALUES %s"
+)
+
+_audit_queue = queue.Queue(maxsize=AUDIT_QUEUE_MAX)
+_audit_cond = threading.Condition()
+_audit_pending = 0  # encoladas o en escritura
+_audit_thread = None
+_audit_stats = {"written": 0, "dropped": 0, "batches": 0, "failed_batches": 0, "last_batch_ms": 0.0}
+
+def _audit_row(user_id, username, action, person_id=None, slot=None, details=None, ts=None):
+    ts = ts or datetime.datetime.now(datetime.timezone.utc)
+    return (ts, user_id, username, action, person_id, slot, Json(details) if details is not None else None)
+
+_audit_partitions_checked = 0.0
+
+def _check_audit_partitions():
+    """Una vez al día: particiones de audit_log para los próximos meses."""
+    global _audit_partitions_checked
+    now = time.monotonic()
+    if _audit_partitions_checked and now - _audit_partitions_checked < AUDIT_PARTITION_CHECK:
+        return
+    _audit_partitions_checked = now
+    from migrations import ensure_audit_partitions  # migrations importa db
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                ensure_audit_partitions(cur)
+    except Exception:
+        _log.exception("No se pudieron crear las particiones de audit_log; se reintenta en una hora")
+        _audit_partitions_checked = now - AUDIT_PARTITION_CHECK + 3600
+
+def _write_audit_rows(rows):
+    _check_audit_partitions()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            execute_values(cur, AUDIT_INSERT_SQL, rows, page_size=1000)
+
+def _write_audit_rows_each(rows) -> int:
+    """Fila por fila (un savepoint por fila); devuelve cuántas se descartaron."""
+    bad = 0
+    with connection() as conn:
+        with conn.cursor() as cur:
+            for row in rows:
+                cur.execute("SAVEPOINT audit_row;")
+                try:
+                    execute_values(cur, AUDIT_INSERT_SQL, [row])
+                except AUDIT_TRANSIENT:
+                    raise
+                except Exception as ex:
+                    cur.execute("ROLLBACK TO SAVEPOINT audit_row;")
+                    bad += 1
+                    _log.error("Auditoría: evento descartado (%s): %r", ex, row)
+                else:
+                    cur.execute("RELEASE SAVEPOINT audit_row;")
+    return bad
+
+def _write_audit_batch(rows) -> int:
+    """
+    Escribe un lote del escritor y devuelve cuántas filas se descartaron.
+    Solo los errores de conexión se reintentan (con espera); si la base
+    rechaza el lote por sus datos, se escribe fila por fila para no perder
+    el resto por una fila mala.
+    """
+    for attempt in range(AUDIT_RETRIES):
+        try:
+            _write_audit_rows(rows)
+            return 0
+        except AUDIT_TRANSIENT:
+            time.sleep(min(2 ** attempt, 10))
+            continue
+        except Exception as ex:
+            _log.warning("Auditoría: lote de %d eventos rechazado (%s); se escribe fila por fila", len(rows), ex)
+        try:
+            return _write_audit_rows_each(rows)
+        except AUDIT_TRANSIENT:
+            time.sleep(min(2 ** attempt, 10))
+    _log.error("Auditoría: sin conexión tras %d intentos; se descartan %d eventos", AUDIT_RETRIES, len(rows))
+    return len(rows)
+
+def _audit_done(n):
+    global _audit_pending
+    with _audit_cond:
+        _audit_pending -= n
+        _audit_cond.notify_all()
+
+def _audit_worker():
+    while True:
+        batch = [_audit_queue.get()]
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while len(batch) < AUDIT_BATCH:
+            try:
+                batch.append(_audit_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        rows = [r for item in batch for r in item]
+        t0 = time.perf_counter()
+        dropped = _write_audit_batch(rows)
+        with _stats_lock:
+            _audit_stats["written"] += len(rows) - dropped
+            _audit_stats["dropped"] += dropped
+            if dropped < len(rows):
+                _audit_stats["batches"] += 1
+                _audit_stats["last_batch_ms"] = (time.perf_counter() - t0) * 1000
+            else:
+                _audit_stats["failed_batches"] += 1
+        _audit_done(len(batch))
+
+def _start_audit_writer():
+    global _audit_thread
+    if _audit_thread is not None and _audit_thread.is_alive():
+        return
+    with _audit_cond:
+        if _audit_thread is None or not _audit_thread.is_alive():
+            _audit_thread = threading.Thread(target=_audit_worker, name="audit-writer", daemon=True)
+            _audit_thread.start()
+
+def _enqueue_audit(rows) -> bool:
+    global _audit_pending
+    _start_audit_writer()
+    with _audit_cond:
+        _audit_pending += 1
+    try:
+        _audit_queue.put(rows, timeout=0.05)
+        return True
+    except queue.Full:
+        _audit_done(1)
+        with _stats_lock:
+            _audit_stats["dropped"] += len(rows)
+        return False
+
+def flush_audit(timeout: float = 10.0) -> bool:
+    """Espera a que se escriba todo lo encolado. False si vence el timeout."""
+    end = time.monotonic() + timeout
+    with _audit_cond:
+        while _audit_pending > 0:
+            if _audit_thread is None or not _audit_thread.is_alive():
+                return False  # p. ej. proceso hijo de un fork: nadie va a escribir
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return False
+            _audit_cond.wait(remaining)
+    return True
+
+atexit.register(flush_audit)
+
+def audit_stats() -> dict:
+    """Cola de auditoría: pendientes, escritos, descartados y duración del último lote (ms)."""
+    with _stats_lock:
+        out = dict(_audit_stats)
+    out["queued"] = _audit_queue.qsize()
+    out["max"] = AUDIT_QUEUE_MAX
+    return out
+
+def log_actions_bulk(user_id, username, action, person_ids, slot=None, details=None, durable=None):
+    """Una fila de audit_log por persona; todas con la misma hora."""
+    if not person_ids:
+        return 0
+    ts = datetime.datetime.now(datetime.timezone.utc)
+    rows = [_audit_row(user_id, username, action, pid, slot, details, ts) for pid in person_ids]
+    if durable or (durable is None and action in AUDIT_DURABLE_ACTIONS):
+        _write_audit_rows(rows)
+    elif not _enqueue_audit(rows):
+        return 0
+    return len(rows)
+
+def log_action(user_id, username, action, person_id=None, slot=None, details=None, durable=None):
+    rows = [_audit_row(user_id, username, action, person_id, slot, details)]
+    if durable or (durable is None and action in AUDIT_DURABLE_ACTIONS):
+        _write_audit_rows(rows)
+    else:
+        _enqueue_audit(rows)
 
 def find_person_by_document(document):
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, region, department, municipality, document, names, phone, email, position, entity FROM people WHERE document=%s", (document,))
-        return cur.fetchone()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, region, department, municipality, document, names, phone, email, position, entity FROM people WHERE document=%s", (document,))
+            return cur.fetchone()
+
+# === Kiosco: documento -> persona en memoria ===
+# Cada escaneo se resuelve contra un dict del proceso (una sola carga de
+# people); solo los documentos que no están van a la base. Si people cambia en
+# este proceso o vence KIOSK_MAP_TTL (otros workers), el dict se recarga en un
+# hilo aparte mientras se sigue usando el anterior. El mapa solo sirve para
+# responder al instante: el diario local guarda el documento y apply_checkins
+# lo vuelve a resolver en la base al aplicar.
+KIOSK_MAP_TTL = float(os.environ.get("KIOSK_MAP_TTL", "300"))
+
+_doc_lock = threading.Lock()
+_doc_map = None      # {documento: (id, nombres)}
+_doc_map_state = None  # (versión de people, expira)
+_doc_loading = None   # threading.Event de la carga en curso
+
+def _load_document_map(version, done):
+    global _doc_map, _doc_map_state, _doc_loading
+    try:
+        with connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT document, id, names FROM people")
+                fresh = {doc: (pid, names) for doc, pid, names in cur}
+        with _doc_lock:
+            _doc_map = fresh
+            _doc_map_state = (version, time.monotonic() + KIOSK_MAP_TTL)
+    finally:
+        with _doc_lock:
+            _doc_loading = None
+        done.set()
+
+def warm_document_map():
+    """
+    Carga el mapa si no está (bloquea solo la primera vez) y lo devuelve.
+    Una sola carga a la vez: si otra sesión ya está cargando la primera, se
+    espera a esa en lugar de leer people de nuevo.
+    """
+    global _doc_loading
+    version = _people_version
+    with _doc_lock:
+        current, state = _doc_map, _doc_map_state
+        stale = state is None or state[0] != version or state[1] <= time.monotonic()
+        loading = _doc_loading
+        start = stale and loading is None
+        if start:
+            loading = _doc_loading = threading.Event()
+    if current is None:
+        if start:
+            _load_document_map(version, loading)  # primera carga: en este hilo
+        else:
+            loading.wait()
+        with _doc_lock:
+            current = _doc_map
+        if current is None:
+            raise RuntimeError("No se pudo cargar el padrón de documentos.")
+        return current
+    if start:
+        threading.Thread(target=_load_document_map, args=(version, loading), name="doc-map", daemon=True).start()
+    return current
+
+def resolve_document(document: str, lookup: bool = True):
+    """
+    (id, nombres) del documento o None; sin consulta si está en el mapa.
+    lookup=False (sin conexión): solo el mapa ya cargado, y False si no está.
+    """
+    if not lookup:
+        return (_doc_map or {}).get(document, False)
+    hit = warm_document_map().get(document)
+    if hit is not None:
+        return hit
+    row = find_person_by_document(document)
+    if row is None:
+        return None
+    hit = (row[0], row[5])
+    with _doc_lock:
+        if _doc_map is not None:
+            _doc_map[document] = hit
+    return hit
+
+# === Confirmaciones diferidas (checkin_journal.py, migración 9) ===
+# Un lote del diario local en una sola sentencia. checkin_key hace que
+# reenviar un lote ya aplicado (p. ej. se cayó la conexión antes de marcarlo
+# como sincronizado) no duplique asistencia ni auditoría.
+def _apply_checkins_sql() -> str:
+    first = " ".join(f"WHEN '{k}' THEN s.{k}" for k in SLOTS)
+    return (
+        "WITH v AS ("
+        "  SELECT * FROM unnest(%(keys)s::text[], %(docs)s::text[], %(slots)s::text[],"
+        "                       %(ts)s::timestamptz[], %(uids)s::int[], %(unames)s::text[])"
+        "    AS v(key, document, slot, ts, uid, uname)"
+        "), a AS ("
+        "  INSERT INTO assistance (person_id, slot, timestamp_utc, checkin_key)"
+        "  SELECT p.id, v.slot, v.ts, v.key FROM v JOIN people p ON p.document = v.document"
+        "  ON CONFLICT (checkin_key) DO NOTHING"
+        "  RETURNING person_id, slot, timestamp_utc, checkin_key"
+        "), s AS ("
+        f"  INSERT INTO attendance_slots (person_id, {', '.join(SLOTS)})"
+        "  SELECT person_id, "
+        + ", ".join(f"MIN(timestamp_utc) FILTER (WHERE slot = '{k}')" for k in SLOTS)
+        + "  FROM a GROUP BY person_id"
+        "  ON CONFLICT (person_id) DO UPDATE SET "
+        # LEAST: un lote atrasado puede traer una marca anterior a la guardada
+        + ", ".join(f"{k} = LEAST(attendance_slots.{k}, EXCLUDED.{k})" for k in SLOTS)
+        + "  RETURNING *"
+        "), l AS ("
+        # con la hora del escaneo, como las filas encoladas por log_action
+        "  INSERT INTO audit_log (timestamp_utc, user_id, username, action, person_id, slot, details)"
+        "  SELECT v.ts, v.uid, v.uname, 'confirm_attendance', a.person_id, a.slot,"
+        "         jsonb_build_object('checkin_key', v.key, 'scanned_at', v.ts)"
+        "  FROM a JOIN v ON v.key = a.checkin_key"
+        ")"
+        " SELECT v.key, CASE"
+        "   WHEN NOT EXISTS (SELECT 1 FROM people p WHERE p.document = v.document) THEN 'missing'"
+        "   WHEN a.checkin_key IS NULL THEN 'ok'"
+        f"   WHEN (CASE a.slot {first} END) = a.timestamp_utc THEN 'first'"
+        "   ELSE 'repeat' END"
+        " FROM v LEFT JOIN a ON a.checkin_key = v.key LEFT JOIN s ON s.person_id = a.person_id"
+    )
+
+def apply_checkins(rows):
+    """
+    rows: [(clave, documento, slot, ts_utc, user_id, username)].
+    Devuelve {clave: resultado}: 'first' (primera marca del slot), 'repeat'
+    (ya tenía marca), 'ok' (la clave ya estaba aplicada) o 'missing' (no
+    existe persona con ese documento).
+    """
+    if not rows:
+        return {}
+    keys, docs, slots, ts, uids, unames = (list(c) for c in zip(*rows))
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(_apply_checkins_sql(), {
+                "keys": keys, "docs": docs, "slots": slots, "ts": ts, "uids": uids, "unames": unames,
+            })
+            return dict(cur.fetchall())
 
 def create_person(region, department, municipality, document, names, phone, email, position, entity):
     row = (region, department, municipality, document, names, phone, email, position, entity)
     upsert_people_bulk([row])
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id FROM people WHERE document=%s", (document,))
-        r = cur.fetchone()
-        return r[0] if r else None
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id FROM people WHERE document=%s", (document,))
+            r = cur.fetchone()
+            return r[0] if r else None
 
 
-# === Import batches (track inserted persons from each import) ===
-def ensure_import_batch_tables():
-    conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute("""CREATE TABLE IF NOT EXISTS import_batch (
-                id SERIAL PRIMARY KEY,
-                created_at TIMESTAMP DEFAULT NOW(),
-                user_id INT,
-                username TEXT,
-                total_rows INT DEFAULT 0,
-                inserted_count INT DEFAULT 0
-            );""")
-            cur.execute("""CREATE TABLE IF NOT EXISTS import_batch_people (
-                batch_id INT REFERENCES import_batch(id) ON DELETE CASCADE,
-                person_id INT REFERENCES people(id) ON DELETE CASCADE
-            );""")
-
-def get_existing_documents(doc_list):
-    if not doc_list:
-        return set()
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT document FROM people WHERE document = ANY(%s)", (doc_list,))
-        return set(d[0] for d in cur.fetchall())
+# === Importación por COPY a tabla temporal ===
+PEOPLE_COLUMNS = ["region","department","municipality","document","names","phone","email","position","entity"]
 
-def get_ids_by_documents(doc_list):
-    if not doc_list:
-        return {}
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, document FROM people WHERE document = ANY(%s)", (doc_list,))
-        return {doc: pid for (pid, doc) in cur.fetchall()}
+# Mismo criterio de actualización que UPSERT_PEOPLE_SQL. Cada bloque se copia
+# a people_stage; import_seen guarda los documentos ya vistos en esta
+# importación, así la primera aparición gana aunque el repetido llegue en otro
+# bloque (y ON CONFLICT nunca toca dos veces la misma fila). xmax = 0 solo en
+# filas recién insertadas: los ids nuevos salen del mismo INSERT.
+IMPORT_CHUNK_SQL = """
+WITH fresh AS (
+  INSERT INTO import_seen (document)
+  SELECT DISTINCT document FROM people_stage
+  ON CONFLICT (document) DO NOTHING
+  RETURNING document
+), up AS (
+  INSERT INTO people (region, department, municipality, document, names, phone, email, position, entity)
+  SELECT DISTINCT ON (s.document) s.region, s.department, s.municipality, s.document, s.names, s.phone, s.email, s.position, s.entity
+  FROM people_stage s JOIN fresh f ON f.document = s.document
+  ORDER BY s.document, s.n
+  ON CONFLICT (document) DO UPDATE
+  SET
+    region = COALESCE(NULLIF(EXCLUDED.region, ''), people.region),
+    department = COALESCE(NULLIF(EXCLUDED.department, ''), people.department),
+    municipality = COALESCE(NULLIF(EXCLUDED.municipality, ''), people.municipality),
+    names = COALESCE(NULLIF(EXCLUDED.names, ''), people.names),
+    phone = COALESCE(NULLIF(EXCLUDED.phone, ''), people.phone),
+    email = COALESCE(NULLIF(EXCLUDED.email, ''), people.email),
+    position = COALESCE(NULLIF(EXCLUDED.position, ''), people.position),
+    entity = COALESCE(NULLIF(EXCLUDED.entity, ''), people.entity)
+  RETURNING id, (xmax = 0) AS inserted
+), n AS (
+  INSERT INTO import_new (person_id) SELECT id FROM up WHERE inserted
+)
+SELECT COUNT(*), COUNT(*) FILTER (WHERE inserted) FROM up;
+"""
 
-def create_import_batch(user_id, username, total_rows, inserted_ids):
-    ensure_import_batch_tables()
-    conn = get_connection()
-    with conn:
+IMPORT_BATCH_SQL = """
+WITH b AS (
+  INSERT INTO import_batch(user_id, username, total_rows, inserted_count)
+  SELECT %s, %s, %s, COUNT(*) FROM import_new
+  RETURNING id
+), bp AS (
+  INSERT INTO import_batch_people(batch_id, person_id) SELECT b.id, n.person_id FROM b, import_new n
+)
+SELECT id FROM b;
+"""
+
+def _rows_csv(rows) -> io.StringIO:
+    buf = io.StringIO()
+    w = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator="\n")  # "" = cadena vacía, no NULL
+    for r in rows:
+        w.writerow(["" if v is None else v for v in r])
+    buf.seek(0)
+    return buf
+
+@contextmanager
+def people_import(user_id=None, username=None):
+    """
+    Importación por bloques en una sola transacción (todo o nada).
+
+        with people_import(uid, uname) as imp:
+            for rows in bloques:
+                imp["load"](rows)      # tuplas en orden PEOPLE_COLUMNS
+        imp["batch_id"], imp["processed"], imp["inserted"], imp["duplicates"]
+
+    Cada load() hace COPY del bloque a una tabla temporal y el upsert; el lote
+    de importación se registra al salir. En Python solo vive el bloque actual.
+    """
+    cols = ", ".join(PEOPLE_COLUMNS)
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO import_batch(user_id, username, total_rows, inserted_count) VALUES (%s,%s,%s,%s) RETURNING id",
-                (user_id, username, total_rows, len(inserted_ids))
+                f"CREATE TEMP TABLE people_stage (n BIGSERIAL, {', '.join(c + ' TEXT' for c in PEOPLE_COLUMNS)}) ON COMMIT DROP;"
+                "CREATE TEMP TABLE import_seen (document TEXT PRIMARY KEY) ON COMMIT DROP;"
+                "CREATE TEMP TABLE import_new (person_id INT) ON COMMIT DROP;"
             )
-            batch_id = cur.fetchone()[0]
-            if inserted_ids:
-                values = [(batch_id, pid) for pid in inserted_ids]
-                from psycopg2.extras import execute_values as _ev
-                _ev(cur, "INSERT INTO import_batch_people(batch_id, person_id) VALUES %s", values, page_size=1000)
-            return batch_id
+            imp = {"rows": 0, "processed": 0, "inserted": 0, "duplicates": 0, "batch_id": None}
+
+            def load(rows):
+                rows = list(rows)
+                if not rows:
+                    return
+                cur.copy_expert(f"COPY people_stage ({cols}) FROM STDIN WITH (FORMAT csv)", _rows_csv(rows))
+                cur.execute(IMPORT_CHUNK_SQL)
+                processed, inserted = cur.fetchone()
+                cur.execute("TRUNCATE people_stage")
+                imp["rows"] += len(rows)
+                imp["processed"] += processed
+                imp["inserted"] += inserted
+                imp["duplicates"] += len(rows) - processed
 
+            imp["load"] = load
+            yield imp
+            cur.execute(IMPORT_BATCH_SQL, (user_id, username, imp["rows"]))
+            imp["batch_id"] = cur.fetchone()[0]
+    _people_changed()
+
+# === Import batches (track inserted persons from each import) ===
 def list_import_batches(limit=20):
-    ensure_import_batch_tables()
-    conn = get_connection()
-    with conn.cursor() as cur:
-        cur.execute("SELECT id, created_at, username, total_rows, inserted_count FROM import_batch ORDER BY id DESC LIMIT %s", (limit,))
-        return cur.fetchall()
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, created_at, username, total_rows, inserted_count FROM import_batch ORDER BY id DESC LIMIT %s", (limit,))
+            return cur.fetchall()
 
 def delete_people_from_batch(batch_id):
-    ensure_import_batch_tables()
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT person_id FROM import_batch_people WHERE batch_id=%s", (batch_id,))
             ids = [r[0] for r in cur.fetchall()]
             if not ids:
                 return 0
+            # por lote, antes que people: así los contadores ven a quién descontar
+            cur.execute("DELETE FROM attendance_slots WHERE person_id = ANY(%s)", (ids,))
             cur.execute("DELETE FROM people WHERE id = ANY(%s)", (ids,))
             deleted = cur.rowcount
             cur.execute("DELETE FROM import_batch_people WHERE batch_id=%s", (batch_id,))
             cur.execute("DELETE FROM import_batch WHERE id=%s", (batch_id,))
-            return deleted
+    _people_changed()
+    return deleted
 
 
 def delete_people_by_ids(ids):
     if not ids:
         return 0
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             # Primero asistencias (por si no hay ON DELETE CASCADE)
             cur.execute("DELETE FROM assistance WHERE person_id = ANY(%s)", (ids,))
+            cur.execute("DELETE FROM attendance_slots WHERE person_id = ANY(%s)", (ids,))
             # Luego personas
             cur.execute("DELETE FROM people WHERE id = ANY(%s)", (ids,))
-            return cur.rowcount
+            deleted = cur.rowcount
+    _people_changed()
+    return deleted
 
 
 # -------- Case-insensitive authentication helper --------
+# Un intento de ingreso = a lo sumo una consulta (o ninguna, si el usuario
+# está en el cache) y una sola verificación bcrypt, que corre en un pool
+# aparte con pocos hilos para que varios intentos simultáneos no se coman la
+# CPU. Si el hash guardado tiene otro costo que BCRYPT_ROUNDS, se rehace en
+# segundo plano después de un ingreso correcto.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+BCRYPT_WORKERS = int(os.environ.get("BCRYPT_WORKERS", "2"))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", "30"))
+
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_user_cache_lock = threading.Lock()
+_user_cache = {}  # lower(username) -> (expira, fila o None)
+_users_version = 0
+_dummy_hash = None  # hash de relleno con el mismo costo, para usuarios inexistentes
+
+def hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode("utf-8")
+
+def _hash_rounds(phash: str) -> int:
+    """Costo de un hash '$2b$12$...'; 0 si no se reconoce."""
+    try:
+        return int(phash.split("$")[2])
+    except (IndexError, ValueError):
+        return 0
+
+def forget_user(username=None):
+    """Invalida el cache de usuarios (uno o todos); llamar después de cambiarlos."""
+    global _users_version
+    with _user_cache_lock:
+        _users_version += 1
+        if username is None:
+            _user_cache.clear()
+        else:
+            _user_cache.pop(username.strip().lower(), None)
+
+def _user_for_login(username: str):
+    # El cache guarda el hash y is_active: solo se usa mientras el listener
+    # está conectado, porque un cambio hecho en otro worker llega por
+    # NOTIFY users_changed (migración 10) y lo vacía aquí.
+    key = username.strip().lower()
+    now = time.monotonic()
+    _start_listener()
+    with _user_cache_lock:
+        hit = _user_cache.get(key)
+        version = _users_version
+    if hit and hit[0] > now and _listening:
+        return hit[1]
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, username, password_hash, is_admin, is_active FROM users WHERE LOWER(username)=LOWER(%s)",
+                (key,)
+            )
+            row = cur.fetchone()
+    with _user_cache_lock:
+        # si algo cambió durante la consulta, no guardar lo leído
+        if _users_version == version:
+            _user_cache[key] = (now + USER_CACHE_TTL, row)
+    return row
+
+def _checkpw(password: str, phash) -> bool:
+    global _dummy_hash
+    if phash is None:
+        if _dummy_hash is None:
+            _dummy_hash = hash_password("-")
+        phash = _dummy_hash
+    try:
+        return bcrypt.checkpw(password.encode("utf-8"), phash.encode("utf-8") if isinstance(phash, str) else phash)
+    except Exception:
+        return False
+
+def _rehash(uid: int, old_hash: str, password: str):
+    new_hash = hash_password(password)
+    with connection() as conn:
+        with conn.cursor() as cur:
+            # solo si nadie cambió la contraseña mientras tanto
+            cur.execute("UPDATE users SET password_hash=%s WHERE id=%s AND password_hash=%s", (new_hash, uid, old_hash))
+            cur.execute("SELECT username FROM users WHERE id=%s", (uid,))
+            row = cur.fetchone()
+    if row:
+        forget_user(row[0])
+
 def authenticate_user_ci(username: str, password: str):
     """
     Authenticate ignoring username case.
     Returns a dict like {"id":..., "username":..., "is_admin":..., "is_active":...}
     or None if invalid.
     """
-    import bcrypt
-    conn = get_connection()
-    with conn:
-        with conn.cursor() as cur:
-            cur.execute(
-                "SELECT id, username, password_hash, is_admin, is_active FROM users WHERE LOWER(username)=LOWER(%s)",
-                (username.strip(),)
-            )
-            row = cur.fetchone()
-            if not row:
-                return None
-            uid, uname, phash, is_admin, is_active = row
-            try:
-                ok = bcrypt.checkpw(password.encode("utf-8"), phash.encode("utf-8") if isinstance(phash, str) else phash)
-            except Exception:
-                ok = False
-            if not ok:
-                return None
-            return {"id": uid, "username": uname, "is_admin": bool(is_admin), "is_active": bool(is_active)}
+    row = _user_for_login(username)
+    # usuario inexistente: se verifica igual contra un hash de relleno (mismo tiempo)
+    ok = _bcrypt_pool.submit(_checkpw, password, row[2] if row else None).result()
+    if not row or not ok:
+        return None
+    uid, uname, phash, is_admin, is_active = row
+    if _hash_rounds(phash) != BCRYPT_ROUNDS:
+        _bcrypt_pool.submit(_rehash, uid, phash, password)
+    return {"id": uid, "username": uname, "is_admin": bool(is_admin), "is_active": bool(is_active)}
@@ -0,0 +1,173 @@
+# downloads.py
+"""
+Descargas de archivos grandes directamente desde el disco.
+
+st.download_button carga el archivo completo en memoria (y lo guarda en el
+almacén de medios de Streamlit). Aquí el archivo queda en el disco y se sirve
+por una ruta propia registrada en el servidor Tornado de Streamlit, que lo
+manda por bloques.
+
+La ruta no es pública como static/: publish() solo se llama desde páginas con
+sesión iniciada y entrega un token aleatorio ligado a esa sesión de Streamlit
+y a la cookie _streamlit_xsrf del navegador. Quien tenga solo la URL (historial,
+logs de un proxy) no descarga nada; tampoco después de DOWNLOAD_TTL_MIN minutos
+o una vez cerrada la sesión, y el archivo se borra al vencer.
+"""
+import atexit
+import html
+import os
+import secrets
+import shutil
+import threading
+import time
+from urllib.parse import quote
+
+import streamlit as st
+import tornado.web
+from streamlit import config
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.web.server.server_util import make_url_path_regex
+
+DOWNLOAD_TTL = float(os.getenv("DOWNLOAD_TTL_MIN", "15")) * 60
+ROUTE = "descargas"
+XSRF_COOKIE = "_streamlit_xsrf"
+CHUNK_BYTES = 1024 * 1024
+
+_lock = threading.Lock()
+_entries = {}  # token -> {path, name, mime, size, remove, session, xsrf, expires}
+_route_ready = False
+
+def _xsrf_secret(value):
+    """
+    Parte fija de la cookie XSRF. Tornado la vuelve a enmascarar en cada
+    respuesta ("2|máscara|token|ts"), así que se compara el token sin máscara.
+    """
+    if not value:
+        return None
+    parts = value.split("|")
+    if len(parts) == 4 and parts[0] == "2":
+        try:
+            mask, masked = bytes.fromhex(parts[1]), bytes.fromhex(parts[2])
+        except ValueError:
+            return None
+        return bytes(b ^ mask[i % 4] for i, b in enumerate(masked))
+    return value.encode()
+
+def _remove(entry) -> None:
+    target = entry["remove"]
+    if os.path.isdir(target):
+        shutil.rmtree(target, ignore_errors=True)
+    else:
+        try:
+            os.remove(target)
+        except OSError:
+            pass
+
+def prune() -> None:
+    """Borra los archivos vencidos."""
+    now = time.time()
+    with _lock:
+        expired = [t for t, e in _entries.items() if e["expires"] <= now]
+        gone = [_entries.pop(t) for t in expired]
+    for entry in gone:
+        _remove(entry)
+
+@atexit.register
+def _remove_all() -> None:
+    with _lock:
+        gone = list(_entries.values())
+        _entries.clear()
+    for entry in gone:
+        _remove(entry)
+
+def _entry(token):
+    with _lock:
+        entry = _entries.get(token)
+    if entry is None or entry["expires"] <= time.time() or not os.path.exists(entry["path"]):
+        return None
+    return entry
+
+class _DownloadHandler(tornado.web.RequestHandler):
+    def initialize(self, runtime) -> None:
+        self._runtime = runtime
+
+    async def get(self, token: str) -> None:
+        entry = _entry(token)
+        if (
+            entry is None
+            or not self._runtime.is_active_session(entry["session"])
+            or (entry["xsrf"] is not None and _xsrf_secret(self.get_cookie(XSRF_COOKIE)) != entry["xsrf"])
+        ):
+            raise tornado.web.HTTPError(404)
+        self.set_header("Content-Type", entry["mime"])
+        self.set_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(entry['name'])}")
+        self.set_header("Content-Length", str(entry["size"]))
+        self.set_header("Cache-Control", "no-store")
+        with open(entry["path"], "rb") as fh:
+            while True:
+                chunk = fh.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                self.write(chunk)
+                await self.flush()
+
+def _ensure_route(session_id: str) -> None:
+    """Registra la ruta en la aplicación Tornado del servidor (una vez por proceso)."""
+    global _route_ready
+    if _route_ready:
+        return
+    with _lock:
+        if _route_ready:
+            return
+        runtime = Runtime.instance()
+        info = runtime._session_mgr.get_active_session_info(session_id)
+        app = getattr(getattr(info, "client", None), "application", None)
+        if app is None:
+            raise RuntimeError("Descargas no disponibles: la página no corre en el servidor de Streamlit.")
+        base = config.get_option("server.baseUrlPath")
+        app.add_handlers(r".*", [
+            (make_url_path_regex(base, rf"{ROUTE}/([A-Za-z0-9_-]+)"), _DownloadHandler, {"runtime": runtime}),
+        ])
+        _route_ready = True
+
+def publish(path: str, file_name: str, mime: str = "application/octet-stream", remove: str = None) -> str:
+    """
+    Deja `path` descargable por la sesión actual y devuelve su URL (relativa).
+    El archivo pasa a ser de este módulo: se borra al vencer (o `remove`, p. ej.
+    la carpeta que lo contiene).
+    """
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        raise RuntimeError("publish() solo se puede llamar desde una página.")
+    try:
+        _ensure_route(ctx.session_id)
+    except Exception:
+        _remove({"remove": remove or path})
+        raise
+    prune()
+    token = secrets.token_urlsafe(24)
+    with _lock:
+        _entries[token] = {
+            "path": path,
+            "name": file_name,
+            "mime": mime,
+            "size": os.path.getsize(path),
+            "remove": remove or path,
+            "session": ctx.session_id,
+            "xsrf": _xsrf_secret(st.context.cookies.get(XSRF_COOKIE)),
+            "expires": time.time() + DOWNLOAD_TTL,
+        }
+    return f"{ROUTE}/{token}"
+
+def available(url: str) -> bool:
+    return _entry(url.rsplit("/", 1)[-1]) is not None
+
+def link(url: str, label: str = None) -> str:
+    """Enlace HTML (para st.markdown(..., unsafe_allow_html=True)) con el tamaño del archivo."""
+    entry = _entry(url.rsplit("/", 1)[-1])
+    if entry is None:
+        return ""
+    label = html.escape(label or entry["name"])
+    return (f'<a href="{url}" download="{html.escape(entry["name"])}">⬇️ {label}</a> '
+            f'({entry["size"] / (1024 * 1024):.1f} MB)')
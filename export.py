@@ -0,0 +1,91 @@
+# export.py
+"""
+Exportación de resultados completos a CSV / Excel sin cargar todo en memoria.
+
+- CSV: COPY ... TO STDOUT directo a un archivo temporal.
+- Excel: cursor server-side + xlsxwriter en modo constant_memory
+  (escribe fila por fila; abre hojas nuevas al pasar el límite de Excel).
+
+Las funciones devuelven la ruta de un archivo temporal; quien llama lo entrega
+con downloads.publish, que lo sirve desde el disco y lo borra al vencer.
+"""
+import datetime
+import json
+import os
+import tempfile
+
+import xlsxwriter
+
+from db import copy_query_csv, iter_query
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+CSV_MIME = "text/csv"
+XLSX_MAX_ROWS = 1_048_576  # límite de filas por hoja en Excel (incluye encabezado)
+
+
+def _tmp_path(suffix: str) -> str:
+    fd, path = tempfile.mkstemp(prefix="export_", suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def _csv_cell(v) -> str:
+    s = str(v)
+    if any(ch in s for ch in ('"', ",", "\n", "\r")):
+        s = '"' + s.replace('"', '""') + '"'
+    return s
+
+
+def export_csv(sql, params, headers) -> str:
+    """CSV UTF-8 con BOM (para que Excel respete las tildes) vía COPY."""
+    path = _tmp_path(".csv")
+    with open(path, "wb") as fh:
+        fh.write(("\ufeff" + ",".join(_csv_cell(h) for h in headers) + "\n").encode("utf-8"))
+        copy_query_csv(sql, params, fh)
+    return path
+
+
+def _xlsx_value(v):
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    if isinstance(v, datetime.datetime):
+        return v.replace(tzinfo=None)
+    if isinstance(v, (dict, list)):
+        return json.dumps(v, ensure_ascii=False, default=str)
+    return str(v)
+
+
+def export_xlsx(sql, params, headers, sheet_name="datos", itersize=5000) -> str:
+    path = _tmp_path(".xlsx")
+    wb = xlsxwriter.Workbook(path, {
+        "constant_memory": True,
+        "default_date_format": "yyyy-mm-dd hh:mm:ss",
+        "strings_to_urls": False,
+        "strings_to_formulas": False,
+    })
+    try:
+        sheet_no = 0
+        ws = None
+        r = XLSX_MAX_ROWS
+        for batch in iter_query(sql, params, itersize=itersize):
+            for row in batch:
+                if r >= XLSX_MAX_ROWS:
+                    sheet_no += 1
+                    ws = wb.add_worksheet(sheet_name if sheet_no == 1 else f"{sheet_name}_{sheet_no}")
+                    ws.write_row(0, 0, headers)
+                    r = 1
+                ws.write_row(r, 0, [_xlsx_value(v) for v in row])
+                r += 1
+        if ws is None:
+            wb.add_worksheet(sheet_name).write_row(0, 0, headers)
+    finally:
+        wb.close()
+    return path
+
+
+def export_query(fmt, sql, params, headers, sheet_name="datos") -> str:
+    """fmt: "xlsx" o "csv". Devuelve la ruta del archivo generado."""
+    if fmt == "csv":
+        return export_csv(sql, params, headers)
+    return export_xlsx(sql, params, headers, sheet_name=sheet_name)
+
@@ -0,0 +1,203 @@
+# importer.py
+"""
+Normalización de archivos de personas para importar, independiente de Streamlit.
+
+Todo trabaja por columna: cada transformación se calcula una vez por valor
+distinto (pd.factorize) y se expande con numpy, en lugar de .apply fila por
+fila. El resultado es el mismo que daban los helpers de routes/import_people.
+"""
+import re
+
+import numpy as np
+import pandas as pd
+
+TARGET = ["region","department","municipality","document","names","phone","email","position","entity"]
+TEXT_COLUMNS = ["region","department","municipality","names","email","position","entity"]
+EMAIL_RE = r"([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})"
+
+def guess(col):
+    key = col.strip().lower()
+    if any(k in key for k in ["document","cedul","dni","cc","identidad"]): return "document"
+    if any(k in key for k in ["nombre","apell"]): return "names"
+    if any(k in key for k in ["telefono","celular","whatsapp","móvil","movil"]): return "phone"
+    if any(k in key for k in ["correo","email","e-mail"]): return "email"
+    if any(k in key for k in ["cargo","rol","puesto","ocupacion","ocupación"]): return "position"
+    if any(k in key for k in ["entidad","empresa","instituci","organiza"]): return "entity"
+    if any(k in key for k in ["municipio","ciudad","localidad"]): return "municipality"
+    if any(k in key for k in ["departamento","distrito","estado"]): return "department"
+    if any(k in key for k in ["provincia","región","region"]): return "region"
+    return ""
+
+_NON_DIGIT = re.compile(r"\D")
+_SPACES = re.compile(r"\s+")
+_NAN_WORD = re.compile(r"\bNAN\b")
+_EMAIL = re.compile(EMAIL_RE)
+
+def _map_unique(s: pd.Series, fn) -> pd.Series:
+    """
+    Aplica fn una vez por valor distinto y expande con los códigos de factorize.
+    Provincias, municipios, entidades o cargos se repiten miles de veces: así
+    el costo depende de los valores distintos y no del total de filas.
+    """
+    codes, uniques = pd.factorize(s, use_na_sentinel=False)
+    mapped = np.array([fn(u) for u in uniques], dtype=object)
+    return pd.Series(mapped[codes] if len(codes) else mapped[:0], index=s.index, dtype=object)
+
+def _text_or_empty(x) -> str:
+    """str(x), dejando en "" los vacíos y los 'nan'."""
+    s = str(x)
+    return s if s.strip() and s.lower() != "nan" else ""
+
+def join_columns(df: pd.DataFrame, cols) -> pd.Series:
+    """Une varias columnas origen con un espacio, omitiendo vacíos."""
+    out = None
+    for c in cols:
+        col = df[c]
+        na = col.isna()
+        if na.any():
+            # celdas vacías: NaN de read_csv y None de openpyxl (values_only)
+            col = col.astype(object).where(~na, "")
+        s = _map_unique(col, _text_or_empty).to_numpy()
+        if out is None:
+            out = s
+            continue
+        both = (out != "") & (s != "")
+        out = np.where(both, out + " " + s, np.where(out != "", out, s))
+    return _map_unique(pd.Series(out, index=df.index, dtype=object), str.strip)
+
+def only_digits(s: pd.Series) -> pd.Series:
+    return _map_unique(s, lambda x: _NON_DIGIT.sub("", x))
+
+def _norm_upper(x: str) -> str:
+    return _SPACES.sub(" ", x.strip().replace("\u00a0", " ")).upper()
+
+def norm_upper(s: pd.Series) -> pd.Series:
+    """strip, NBSP -> espacio, colapsa espacios y pasa a mayúsculas."""
+    return _map_unique(s, _norm_upper)
+
+def _clean_names(x: str) -> str:
+    return _SPACES.sub(" ", _NAN_WORD.sub("", x)).strip()
+
+def _clean_email(x: str) -> str:
+    m = _EMAIL.search(x.upper().replace("ANONYMOUS", "").strip())
+    return m.group(1) if m else ""
+
+def clean_email(s: pd.Series) -> pd.Series:
+    return _map_unique(s, _clean_email)
+
+def normalize_column(df: pd.DataFrame, dest: str, cols) -> pd.Series:
+    """
+    Una columna destino a partir de sus columnas origen (ya unidas y normalizadas).
+    Cada destino es independiente: cambiar el mapeo de uno no obliga a recalcular los demás.
+    """
+    if cols:
+        s = join_columns(df, cols).reset_index(drop=True)
+    else:
+        s = pd.Series("", index=pd.RangeIndex(len(df)), dtype=object)
+    if dest in ("document", "phone"):
+        s = only_digits(s)
+    if dest in TEXT_COLUMNS:
+        s = norm_upper(s)
+    if dest == "names":
+        s = _map_unique(s, _clean_names)
+    elif dest == "email":
+        s = clean_email(s)
+    return s
+
+def mapped_columns(mapping, dest: str) -> list:
+    return [src for src, d in mapping.items() if d == dest]
+
+def normalize_people(df: pd.DataFrame, mapping) -> pd.DataFrame:
+    """
+    df: archivo leído tal cual. mapping: {columna origen: destino en TARGET o ""}.
+    Devuelve un DataFrame con las columnas TARGET (str) ya normalizadas.
+    """
+    return pd.DataFrame({dest: normalize_column(df, dest, mapped_columns(mapping, dest)) for dest in TARGET},
+                        index=pd.RangeIndex(len(df)))
+
+# -------------------------------------------------------------------
+# Lectura por bloques: nunca se carga el archivo completo en memoria.
+# xlsx con openpyxl read_only (fila a fila), CSV con read_csv(chunksize).
+# Los valores se leen como texto/objeto: un documento numérico con celdas
+# vacías en la columna ya no pasa por float ("123.0").
+# -------------------------------------------------------------------
+CHUNK_ROWS = 5000
+
+def _is_csv(name: str) -> bool:
+    return name.lower().endswith(".csv")
+
+def _header(cells) -> list:
+    """Nombres de columna como los pone pandas: 'Unnamed: i' y sufijos .1, .2 para repetidos."""
+    out, seen = [], {}
+    for i, c in enumerate(cells):
+        name = f"Unnamed: {i}" if c is None or str(c).strip() == "" else str(c)
+        base = name
+        while name in seen:
+            seen[base] += 1
+            name = f"{base}.{seen[base]}"
+        seen[name] = 0
+        out.append(name)
+    return out
+
+def sheet_names(fileobj, name: str) -> list:
+    if _is_csv(name):
+        return []
+    import openpyxl
+    fileobj.seek(0)
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+def iter_chunks(fileobj, name: str, sheet=None, chunk_rows: int = CHUNK_ROWS, max_rows=None):
+    """
+    Genera (DataFrame, fracción_leída) por bloques de `chunk_rows` filas.
+    max_rows corta la lectura (previsualización).
+    """
+    fileobj.seek(0)
+    if _is_csv(name):
+        size = getattr(fileobj, "size", None) or 0
+        if max_rows is not None:
+            yield pd.read_csv(fileobj, dtype=str, nrows=max_rows), 1.0
+            return
+        for chunk in pd.read_csv(fileobj, dtype=str, chunksize=chunk_rows):
+            frac = min(fileobj.tell() / size, 1.0) if size else 0.0
+            yield chunk.reset_index(drop=True), frac
+        return
+
+    import openpyxl
+    wb = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet] if sheet else wb.worksheets[0]
+        total = max((ws.max_row or 0) - 1, 0)
+        rows = ws.iter_rows(values_only=True)
+        header = list(next(rows, None) or [])
+        while header and (header[-1] is None or str(header[-1]).strip() == ""):
+            header.pop()  # columnas vacías al final (celdas con formato)
+        if not header:
+            return
+        cols = _header(header)
+        width = len(cols)
+        buf, read = [], 0
+        limit = chunk_rows if max_rows is None else min(chunk_rows, max_rows)
+        for r in rows:
+            if all(v is None for v in r):
+                continue
+            buf.append(tuple(r[:width]) + (None,) * (width - len(r)))
+            read += 1
+            if len(buf) >= limit or (max_rows is not None and read >= max_rows):
+                yield pd.DataFrame(buf, columns=cols, dtype=object), (min(read / total, 1.0) if total else 0.0)
+                buf = []
+                if max_rows is not None and read >= max_rows:
+                    return
+        if buf or read == 0:
+            yield pd.DataFrame(buf, columns=cols, dtype=object), 1.0
+    finally:
+        wb.close()
+
+def read_preview(fileobj, name: str, sheet=None, n: int = 200) -> pd.DataFrame:
+    """Solo las primeras n filas (para mapeo y previsualización)."""
+    for df, _ in iter_chunks(fileobj, name, sheet, max_rows=n):
+        return df
+    return pd.DataFrame()
@@ -0,0 +1,523 @@
+# migrations.py
+"""
+Esquema de la base de datos por versiones.
+
+Cada migración se aplica una sola vez y queda registrada en schema_version.
+ensure_schema() se llama al arrancar (main.py): la primera vez en el proceso
+toma un advisory lock (para que varias réplicas no migren a la vez), aplica lo
+pendiente, crea las particiones de audit_log de los próximos meses y el admin
+por defecto si no hay usuarios. Las siguientes
+llamadas no tocan la base, así ninguna consulta de esquema queda en el camino
+de cada rerun.
+
+Para cambiar el esquema: agregar una función al final de MIGRATIONS con el
+número siguiente. Nunca editar una migración ya publicada.
+"""
+import datetime
+import threading
+
+import psycopg2
+
+from db import SLOTS, connection, hash_password
+
+MIGRATION_LOCK_KEY = 7_245_310_015  # pg_advisory_xact_lock(bigint)
+AUDIT_PARTITION_LOCK_KEY = 7_245_310_019
+
+def _try_ddl(cur, sql) -> bool:
+    """Ejecuta DDL opcional dentro de un savepoint; si falla no aborta la transacción."""
+    cur.execute("SAVEPOINT try_ddl;")
+    try:
+        cur.execute(sql)
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT try_ddl;")
+        return False
+    cur.execute("RELEASE SAVEPOINT try_ddl;")
+    return True
+
+def _m001_base(cur):
+    """Tablas originales (con IF NOT EXISTS: las bases ya creadas quedan igual)."""
+    cur.execute("""CREATE TABLE IF NOT EXISTS people (
+      id SERIAL PRIMARY KEY,
+      region VARCHAR(255),
+      department VARCHAR(255),
+      municipality VARCHAR(255),
+      document VARCHAR(50) UNIQUE NOT NULL,
+      names VARCHAR(255) NOT NULL,
+      phone VARCHAR(50),
+      email VARCHAR(255),
+      position VARCHAR(255),
+      entity VARCHAR(255)
+    );""" )
+    cur.execute("""CREATE TABLE IF NOT EXISTS assistance (
+      id SERIAL PRIMARY KEY,
+      person_id INT NOT NULL REFERENCES people(id) ON DELETE CASCADE,
+      timestamp_utc TIMESTAMP DEFAULT NOW(),
+      slot TEXT
+    );""" )
+    cur.execute("""DO $$
+    BEGIN
+      IF NOT EXISTS (
+        SELECT 1 FROM information_schema.check_constraints
+        WHERE constraint_name = 'assistance_slot_check'
+      ) THEN
+        ALTER TABLE assistance
+        ADD CONSTRAINT assistance_slot_check
+        CHECK (slot IN ('registro_dia1_manana','registro_dia1_tarde','registro_dia2_manana','registro_dia2_tarde'));
+      END IF;
+    END$$;""" )
+    cur.execute("""CREATE TABLE IF NOT EXISTS users (
+      id SERIAL PRIMARY KEY,
+      username VARCHAR(100) UNIQUE NOT NULL,
+      password_hash VARCHAR(200) NOT NULL,
+      is_admin BOOLEAN NOT NULL DEFAULT FALSE,
+      is_active BOOLEAN NOT NULL DEFAULT TRUE,
+      created_at TIMESTAMP DEFAULT NOW()
+    );""" )
+    cur.execute("""CREATE TABLE IF NOT EXISTS attendance_slots (
+      person_id INT PRIMARY KEY REFERENCES people(id) ON DELETE CASCADE,
+      registro_dia1_manana TIMESTAMP NULL,
+      registro_dia1_tarde  TIMESTAMP NULL,
+      registro_dia2_manana TIMESTAMP NULL,
+      registro_dia2_tarde  TIMESTAMP NULL
+    );""" )
+    cur.execute("""CREATE TABLE IF NOT EXISTS settings (
+      key TEXT PRIMARY KEY,
+      value TEXT NOT NULL
+    );""" )
+    cur.execute("""INSERT INTO settings(key, value)
+    VALUES ('active_slot', 'registro_dia1_manana')
+    ON CONFLICT (key) DO NOTHING;""" )
+    cur.execute("""CREATE TABLE IF NOT EXISTS audit_log (
+        id SERIAL PRIMARY KEY,
+        timestamp_utc TIMESTAMP DEFAULT NOW(),
+        user_id INT,
+        username TEXT,
+        action TEXT NOT NULL,
+        person_id INT,
+        slot TEXT,
+        details JSONB
+    );""" )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_audit_ts ON audit_log(timestamp_utc DESC);")
+    cur.execute("""CREATE TABLE IF NOT EXISTS import_batch (
+        id SERIAL PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT NOW(),
+        user_id INT,
+        username TEXT,
+        total_rows INT DEFAULT 0,
+        inserted_count INT DEFAULT 0
+    );""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS import_batch_people (
+        batch_id INT REFERENCES import_batch(id) ON DELETE CASCADE,
+        person_id INT REFERENCES people(id) ON DELETE CASCADE
+    );""")
+
+def _m002_search(cur):
+    """
+    norm_text(x) = unaccent(lower(x)) declarado IMMUTABLE para poder indexarlo.
+    unaccent() a secas es STABLE; la forma con diccionario explícito sí es segura.
+    Sin la extensión unaccent queda como lower(x); sin pg_trgm no hay índices
+    de subcadena (la búsqueda funciona igual, sin índice).
+    """
+    _try_ddl(cur, "CREATE EXTENSION IF NOT EXISTS unaccent;")
+    _try_ddl(cur, "CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    ok = _try_ddl(cur, """CREATE OR REPLACE FUNCTION norm_text(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, lower($1)) $$;""")
+    if not ok:
+        cur.execute("""CREATE OR REPLACE FUNCTION norm_text(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            AS $$ SELECT lower($1) $$;""")
+    # prefijo / exacto de documento (LIKE '123%')
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_people_document_prefix ON people (document varchar_pattern_ops);")
+    # subcadenas: requieren pg_trgm
+    _try_ddl(cur, "CREATE INDEX IF NOT EXISTS idx_people_names_trgm ON people USING gin (norm_text(names) gin_trgm_ops);")
+    _try_ddl(cur, "CREATE INDEX IF NOT EXISTS idx_people_document_trgm ON people USING gin (document gin_trgm_ops);")
+
+SECONDARY_INDEXES = [
+    # clear_attendance_slot y el ON DELETE CASCADE desde people
+    "CREATE INDEX IF NOT EXISTS idx_assistance_person_slot ON assistance (person_id, slot);",
+    # delete_people_from_batch y el ON DELETE CASCADE desde people / import_batch
+    "CREATE INDEX IF NOT EXISTS idx_import_batch_people_batch ON import_batch_people (batch_id);",
+    "CREATE INDEX IF NOT EXISTS idx_import_batch_people_person ON import_batch_people (person_id);",
+    # filtros de Auditoría (ordenados por fecha)
+    "CREATE INDEX IF NOT EXISTS idx_audit_action_ts ON audit_log (action, timestamp_utc DESC);",
+    "CREATE INDEX IF NOT EXISTS idx_audit_username_ts ON audit_log (username, timestamp_utc DESC);",
+]
+
+def _m003_secondary_indexes(cur):
+    """
+    Índices por clave foránea y filtros. Sin ellos, borrar personas hace un
+    seq scan de assistance e import_batch_people por cada fila borrada.
+    """
+    for sql in SECONDARY_INDEXES:
+        cur.execute(sql)
+    # "Usuario (contiene)" usa ILIKE '%x%': solo un índice trigram lo aprovecha
+    _try_ddl(cur, "CREATE INDEX IF NOT EXISTS idx_audit_username_trgm ON audit_log USING gin (username gin_trgm_ops);")
+
+def _m004_settings_notify(cur):
+    """Todo cambio en settings avisa por NOTIFY settings_changed (cache de db.get_settings)."""
+    cur.execute("""CREATE OR REPLACE FUNCTION notify_settings_changed() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          IF TG_OP = 'DELETE' THEN
+            PERFORM pg_notify('settings_changed', OLD.key);
+          ELSE
+            PERFORM pg_notify('settings_changed', NEW.key);
+          END IF;
+          RETURN NULL;
+        END $$;""")
+    cur.execute("DROP TRIGGER IF EXISTS settings_notify ON settings;")
+    cur.execute("""CREATE TRIGGER settings_notify AFTER INSERT OR UPDATE OR DELETE ON settings
+        FOR EACH ROW EXECUTE PROCEDURE notify_settings_changed();""")
+
+AUDIT_MONTHS_AHEAD = 3
+
+def _add_months(d: datetime.date, n: int) -> datetime.date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return datetime.date(d.year + y, m + 1, 1)
+
+def _create_audit_partition(cur, name: str, month: datetime.date, nxt: datetime.date):
+    bounds = f"FOR VALUES FROM ('{month}') TO ('{nxt}')"
+    cur.execute("SELECT EXISTS (SELECT 1 FROM audit_log_default WHERE timestamp_utc >= %s AND timestamp_utc < %s);",
+                (month, nxt))
+    if not cur.fetchone()[0]:
+        cur.execute(f"CREATE TABLE {name} PARTITION OF audit_log {bounds};")
+        return
+    # El mes ya tiene filas en audit_log_default y Postgres no deja crear la
+    # partición así: se pasan a una tabla nueva y después se adjunta.
+    cur.execute(f"CREATE TABLE {name} (LIKE audit_log INCLUDING DEFAULTS);")
+    cur.execute(f"""WITH moved AS (
+            DELETE FROM audit_log_default WHERE timestamp_utc >= %s AND timestamp_utc < %s RETURNING *
+        ) INSERT INTO {name} SELECT * FROM moved;""", (month, nxt))
+    cur.execute(f"ALTER TABLE audit_log ATTACH PARTITION {name} {bounds};")
+
+def ensure_audit_partitions(cur, start=None, months_ahead: int = AUDIT_MONTHS_AHEAD):
+    """
+    Particiones mensuales audit_log_AAAAMM desde el mes de start (o el actual)
+    hasta months_ahead meses adelante. Lo que caiga fuera va a audit_log_default.
+    Se llama al migrar y a diario desde el escritor de auditoría (db.py); los
+    errores se propagan.
+    """
+    cur.execute("SELECT pg_advisory_xact_lock(%s);", (AUDIT_PARTITION_LOCK_KEY,))
+    month = (start or datetime.date.today()).replace(day=1)
+    last = _add_months(datetime.date.today().replace(day=1), months_ahead)
+    while month <= last:
+        nxt = _add_months(month, 1)
+        name = f"audit_log_{month:%Y%m}"
+        cur.execute("SELECT to_regclass(%s);", (name,))
+        if cur.fetchone()[0] is None:
+            _create_audit_partition(cur, name, month, nxt)
+        month = nxt
+
+def _m005_audit_partitions(cur):
+    """
+    audit_log particionada por mes (timestamp_utc). Se copia la tabla anterior
+    y los índices se crean al final, sobre la tabla padre (cada partición
+    recibe los suyos). La PK (timestamp_utc, id) sirve el orden de la página
+    de Auditoría y la paginación por keyset.
+    """
+    cur.execute("ALTER TABLE audit_log RENAME TO audit_log_old;")
+    cur.execute("""CREATE TABLE audit_log (
+        id BIGINT NOT NULL DEFAULT nextval('audit_log_id_seq'),
+        timestamp_utc TIMESTAMP NOT NULL DEFAULT NOW(),
+        user_id INT,
+        username TEXT,
+        action TEXT NOT NULL,
+        person_id INT,
+        slot TEXT,
+        details JSONB
+    ) PARTITION BY RANGE (timestamp_utc);""")
+    cur.execute("ALTER SEQUENCE audit_log_id_seq AS BIGINT OWNED BY audit_log.id;")
+    cur.execute("CREATE TABLE audit_log_default PARTITION OF audit_log DEFAULT;")
+    cur.execute("SELECT MIN(timestamp_utc) FROM audit_log_old;")
+    first = cur.fetchone()[0]
+    ensure_audit_partitions(cur, first.date() if first else None)
+    cur.execute("""INSERT INTO audit_log (id, timestamp_utc, user_id, username, action, person_id, slot, details)
+        SELECT id, COALESCE(timestamp_utc, NOW()), user_id, username, action, person_id, slot, details
+        FROM audit_log_old;""")
+    cur.execute("DROP TABLE audit_log_old;")
+    cur.execute("ALTER TABLE audit_log ADD PRIMARY KEY (timestamp_utc, id);")
+    cur.execute("CREATE INDEX idx_audit_action_ts ON audit_log (action, timestamp_utc, id);")
+    cur.execute("CREATE INDEX idx_audit_username_ts ON audit_log (username, timestamp_utc, id);")
+    cur.execute("CREATE INDEX idx_audit_person_ts ON audit_log (person_id, timestamp_utc, id);")
+    cur.execute("CREATE INDEX idx_audit_details ON audit_log USING gin (details);")
+    _try_ddl(cur, "CREATE INDEX idx_audit_username_trgm ON audit_log USING gin (username gin_trgm_ops);")
+
+def _m006_certificate_summary(cur):
+    """
+    certificate_summary: documento -> (persona, nombre, momentos asistidos, %),
+    una fila por persona. La mantienen triggers por sentencia (con tablas de
+    transición) sobre people y attendance_slots, así cualquier camino que
+    marque o borre asistencia (confirmar, masivo, importación) la deja al día
+    sin recalcular todo.
+    """
+    attended = "num_nonnulls(" + ", ".join(f"x.{s}" for s in SLOTS) + ")"
+    cur.execute("""CREATE TABLE certificate_summary (
+        document VARCHAR(50) PRIMARY KEY,
+        person_id INT NOT NULL UNIQUE REFERENCES people(id) ON DELETE CASCADE,
+        names VARCHAR(255),
+        slots SMALLINT NOT NULL DEFAULT 0,
+        percent NUMERIC(5,2) NOT NULL DEFAULT 0
+    );""")
+    cur.execute(f"""INSERT INTO certificate_summary (document, person_id, names, slots, percent)
+        SELECT p.document, p.id, p.names, {attended}, {attended} * 100.0 / {len(SLOTS)}
+        FROM people p LEFT JOIN attendance_slots x ON x.person_id = p.id;""")
+    cur.execute("CREATE INDEX idx_certificate_summary_percent ON certificate_summary (percent);")
+
+    cur.execute("""CREATE OR REPLACE FUNCTION cert_people_ins() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          INSERT INTO certificate_summary (document, person_id, names)
+          SELECT document, id, names FROM n
+          ON CONFLICT DO NOTHING;
+          RETURN NULL;
+        END $$;""")
+    cur.execute("""CREATE OR REPLACE FUNCTION cert_people_upd() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          UPDATE certificate_summary c SET document = n.document, names = n.names
+          FROM n
+          WHERE c.person_id = n.id
+            AND (c.document IS DISTINCT FROM n.document OR c.names IS DISTINCT FROM n.names);
+          RETURN NULL;
+        END $$;""")
+    cur.execute(f"""CREATE OR REPLACE FUNCTION cert_slots_set() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          UPDATE certificate_summary c SET slots = k.n, percent = k.n * 100.0 / {len(SLOTS)}
+          FROM (SELECT x.person_id, {attended} AS n FROM n x) k
+          WHERE c.person_id = k.person_id AND c.slots <> k.n;
+          RETURN NULL;
+        END $$;""")
+    cur.execute("""CREATE OR REPLACE FUNCTION cert_slots_del() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          UPDATE certificate_summary c SET slots = 0, percent = 0
+          FROM o WHERE c.person_id = o.person_id;
+          RETURN NULL;
+        END $$;""")
+    for name, event, table, ref, fn in [
+        ("cert_people_ins", "INSERT", "people", "NEW TABLE AS n", "cert_people_ins"),
+        ("cert_people_upd", "UPDATE", "people", "NEW TABLE AS n", "cert_people_upd"),
+        ("cert_slots_ins", "INSERT", "attendance_slots", "NEW TABLE AS n", "cert_slots_set"),
+        ("cert_slots_upd", "UPDATE", "attendance_slots", "NEW TABLE AS n", "cert_slots_set"),
+        ("cert_slots_del", "DELETE", "attendance_slots", "OLD TABLE AS o", "cert_slots_del"),
+    ]:
+        cur.execute(f"""CREATE TRIGGER {name} AFTER {event} ON {table}
+            REFERENCING {ref} FOR EACH STATEMENT EXECUTE PROCEDURE {fn}();""")
+
+def _m007_certificate_registry(cur):
+    """
+    Registro de certificados cargado desde Excel, por versiones. La versión
+    activa está en settings (cert_registry_version): cambiarla es el swap
+    atómico, y el NOTIFY de settings avisa a todos los procesos.
+    """
+    cur.execute("""CREATE TABLE certificate_registry_version (
+        version SERIAL PRIMARY KEY,
+        created_at TIMESTAMP DEFAULT NOW(),
+        username TEXT,
+        content_hash TEXT,
+        rows INT NOT NULL DEFAULT 0
+    );""")
+    cur.execute("""CREATE TABLE certificate_registry (
+        version INT NOT NULL REFERENCES certificate_registry_version(version) ON DELETE CASCADE,
+        document VARCHAR(50) NOT NULL,
+        names TEXT,
+        percent NUMERIC(6,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (version, document)
+    );""")
+
+REGISTERED = "registrados"  # fila de attendance_counters con el total de personas
+
+def _counters_deltas(expr):
+    return ", ".join(f"('{s}', {expr.format(s=s)})" for s in SLOTS)
+
+_COUNTERS_BUCKET = "COALESCE(p.region, '') AS region, COALESCE(p.entity, '') AS entity"
+
+def _counters_trigger_functions(cur):
+    """
+    (Re)crea las funciones de los triggers de attendance_counters y devuelve
+    [(función, evento, tabla, REFERENCING)]. ORDER BY en el upsert: las filas
+    de contadores se bloquean siempre en el mismo orden, así dos sentencias
+    concurrentes (diario de varios procesos, confirmar/borrar por lote) no se
+    bloquean mutuamente (deadlock).
+    """
+    deltas, bucket = _counters_deltas, _COUNTERS_BUCKET
+    upsert = """INSERT INTO attendance_counters AS c (slot, region, entity, n)
+          SELECT d.slot, d.region, d.entity, SUM(d.n) FROM ({src}) d
+          GROUP BY 1, 2, 3 HAVING SUM(d.n) <> 0
+          ORDER BY 1, 2, 3
+          ON CONFLICT (slot, region, entity) DO UPDATE SET n = c.n + EXCLUDED.n;"""
+    slot_src = {
+        "ins": f"""SELECT v.slot, {bucket}, v.n
+            FROM n JOIN people p ON p.id = n.person_id
+            CROSS JOIN LATERAL (VALUES {deltas("(n.{s} IS NOT NULL)::int")}) v(slot, n)""",
+        "upd": f"""SELECT v.slot, {bucket}, v.n
+            FROM n JOIN o ON o.person_id = n.person_id JOIN people p ON p.id = n.person_id
+            CROSS JOIN LATERAL (VALUES {deltas("(n.{s} IS NOT NULL)::int - (o.{s} IS NOT NULL)::int")}) v(slot, n)""",
+        "del": f"""SELECT v.slot, {bucket}, v.n
+            FROM o JOIN people p ON p.id = o.person_id
+            CROSS JOIN LATERAL (VALUES {deltas("-(o.{s} IS NOT NULL)::int")}) v(slot, n)""",
+    }
+    people_src = {
+        "ins": f"SELECT '{REGISTERED}' AS slot, COALESCE(region, '') AS region, COALESCE(entity, '') AS entity, 1 AS n FROM n",
+        "del": f"SELECT '{REGISTERED}' AS slot, COALESCE(region, '') AS region, COALESCE(entity, '') AS entity, -1 AS n FROM o",
+        # cambio de provincia/entidad: mover el inscrito y sus momentos al grupo nuevo
+        "upd": f"""SELECT v.slot, r.region, r.entity, r.sign * v.on_::int AS n
+            FROM n JOIN o ON o.id = n.id
+            LEFT JOIN attendance_slots s ON s.person_id = n.id
+            CROSS JOIN LATERAL (VALUES (COALESCE(n.region, ''), COALESCE(n.entity, ''), 1),
+                                       (COALESCE(o.region, ''), COALESCE(o.entity, ''), -1)) r(region, entity, sign)
+            CROSS JOIN LATERAL (VALUES ('{REGISTERED}', TRUE), {deltas("s.{s} IS NOT NULL")}) v(slot, on_)
+            WHERE (o.region, o.entity) IS DISTINCT FROM (n.region, n.entity) AND v.on_""",
+    }
+    out = []
+    for table, srcs, events in [
+        ("attendance_slots", slot_src, {"ins": ("INSERT", "NEW TABLE AS n"),
+                                        "upd": ("UPDATE", "OLD TABLE AS o NEW TABLE AS n"),
+                                        "del": ("DELETE", "OLD TABLE AS o")}),
+        ("people", people_src, {"ins": ("INSERT", "NEW TABLE AS n"),
+                                "upd": ("UPDATE", "OLD TABLE AS o NEW TABLE AS n"),
+                                "del": ("DELETE", "OLD TABLE AS o")}),
+    ]:
+        for op, (event, ref) in events.items():
+            fn = f"counters_{table}_{op}"
+            first = "o" if op == "del" else "n"
+            cur.execute(f"""CREATE OR REPLACE FUNCTION {fn}() RETURNS trigger LANGUAGE plpgsql AS $$
+                BEGIN
+                  IF NOT EXISTS (SELECT 1 FROM {first}) THEN
+                    RETURN NULL;
+                  END IF;
+                  {upsert.format(src=srcs[op])}
+                  PERFORM pg_notify('attendance_changed', '');
+                  RETURN NULL;
+                END $$;""")
+            out.append((fn, event, table, ref))
+    return out
+
+def _m008_attendance_counters(cur):
+    """
+    attendance_counters: (momento, provincia, entidad) -> personas, más la
+    fila REGISTERED con el total inscrito. La mantienen triggers por sentencia
+    sobre attendance_slots y people, en la misma transacción que el cambio,
+    y cada cambio avisa por NOTIFY attendance_changed (tablero en vivo).
+
+    Borrar una persona borra su attendance_slots por cascada cuando la fila de
+    people ya no es visible; por eso un trigger BEFORE DELETE en people borra
+    antes su attendance_slots (las funciones de db.py ya lo hacen por lote).
+    """
+    deltas, bucket = _counters_deltas, _COUNTERS_BUCKET
+
+    cur.execute("""CREATE TABLE attendance_counters (
+        slot TEXT NOT NULL,
+        region TEXT NOT NULL,
+        entity TEXT NOT NULL,
+        n BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (slot, region, entity)
+    );""")
+    cur.execute(f"""CREATE OR REPLACE FUNCTION rebuild_attendance_counters() RETURNS void LANGUAGE sql AS $$
+        DELETE FROM attendance_counters;
+        INSERT INTO attendance_counters (slot, region, entity, n)
+        SELECT v.slot, {bucket}, COUNT(*)
+        FROM people p
+        LEFT JOIN attendance_slots s ON s.person_id = p.id
+        CROSS JOIN LATERAL (VALUES ('{REGISTERED}', TRUE), {deltas("s.{s} IS NOT NULL")}) v(slot, on_)
+        WHERE v.on_
+        GROUP BY 1, 2, 3;
+    $$;""")
+    cur.execute("SELECT rebuild_attendance_counters();")
+
+    for fn, event, table, ref in _counters_trigger_functions(cur):
+        cur.execute(f"""CREATE TRIGGER {fn} AFTER {event} ON {table}
+            REFERENCING {ref} FOR EACH STATEMENT EXECUTE PROCEDURE {fn}();""")
+
+    cur.execute("""CREATE OR REPLACE FUNCTION people_drop_slots() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+          DELETE FROM attendance_slots WHERE person_id = OLD.id;
+          RETURN OLD;
+        END $$;""")
+    cur.execute("""CREATE TRIGGER people_drop_slots BEFORE DELETE ON people
+        FOR EACH ROW EXECUTE PROCEDURE people_drop_slots();""")
+
+def _m009_checkin_keys(cur):
+    """
+    Clave de idempotencia de las confirmaciones que llegan desde el diario
+    local (checkin_journal.py): reenviar un lote ya aplicado no duplica nada.
+    """
+    cur.execute("ALTER TABLE assistance ADD COLUMN IF NOT EXISTS checkin_key TEXT;")
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_assistance_checkin_key ON assistance (checkin_key);")
+
+def _m010_users_notify(cur):
+    """Todo cambio en users avisa por NOTIFY users_changed (cache de ingreso de db.py)."""
+    cur.execute("""CREATE OR REPLACE FUNCTION notify_users_changed() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+          PERFORM pg_notify('users_changed', '');
+          RETURN NULL;
+        END $$;""")
+    cur.execute("DROP TRIGGER IF EXISTS users_notify ON users;")
+    cur.execute("""CREATE TRIGGER users_notify AFTER INSERT OR UPDATE OR DELETE ON users
+        FOR EACH STATEMENT EXECUTE PROCEDURE notify_users_changed();""")
+
+def _m011_counters_lock_order(cur):
+    """Contadores: upsert en orden fijo (las bases con la migración 8 ya aplicada)."""
+    _counters_trigger_functions(cur)
+
+MIGRATIONS = [
+    (1, "esquema base", _m001_base),
+    (2, "búsqueda por nombre y documento", _m002_search),
+    (3, "índices secundarios de asistencia, lotes y auditoría", _m003_secondary_indexes),
+    (4, "aviso de cambios en settings", _m004_settings_notify),
+    (5, "audit_log particionada por mes", _m005_audit_partitions),
+    (6, "resumen de asistencia para certificados", _m006_certificate_summary),
+    (7, "registro de certificados por versiones", _m007_certificate_registry),
+    (8, "contadores de asistencia en vivo", _m008_attendance_counters),
+    (9, "clave de idempotencia en assistance", _m009_checkin_keys),
+    (10, "aviso de cambios en users", _m010_users_notify),
+    (11, "orden de bloqueo en los contadores", _m011_counters_lock_order),
+]
+
+DEFAULT_ADMIN = ("admin", "Admin2025!")
+
+def _ensure_default_admin(cur):
+    cur.execute("SELECT EXISTS (SELECT 1 FROM users);")
+    if cur.fetchone()[0]:
+        return
+    username, password = DEFAULT_ADMIN
+    cur.execute("INSERT INTO users (username, password_hash, is_admin, is_active) VALUES (%s, %s, TRUE, TRUE);", (username, hash_password(password)))
+
+def migrate() -> list:
+    """
+    Aplica las migraciones pendientes en una sola transacción, bajo advisory
+    lock: si otro proceso está migrando, espera y luego ve todo aplicado.
+    Devuelve las versiones aplicadas en esta llamada.
+    """
+    applied = []
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATION_LOCK_KEY,))
+            cur.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                version INT PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT NOW()
+            );""")
+            cur.execute("SELECT version FROM schema_version;")
+            done = {r[0] for r in cur.fetchall()}
+            for version, name, fn in MIGRATIONS:
+                if version in done:
+                    continue
+                fn(cur)
+                cur.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s);", (version, name))
+                applied.append(version)
+            ensure_audit_partitions(cur)
+            _ensure_default_admin(cur)
+    return applied
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+def ensure_schema() -> None:
+    """migrate() una vez por proceso; después no hace nada."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            migrate()
+            _schema_ready = True
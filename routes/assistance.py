@@ -1,7 +1,8 @@
 
 import streamlit as st
+import checkin_journal
 from db import (
-    get_active_slot, set_active_slot, mark_attendance_for_slot,
+    get_active_slot, set_active_slot,
     find_person_by_document, create_person,
     get_attendance_status, clear_attendance_slot, log_action
 )
@@ -68,14 +69,14 @@ def page():
 
         if st.button("Confirmar asistencia"):
             slot = get_active_slot()
-            mark_attendance_for_slot(p["id"], slot)
+            # al diario local; se aplica en la base en segundo plano
+            checkin_journal.record(p["document"], slot, st.session_state.get('user'))
             st.success(f"Asistencia registrada en **{slot.replace('_',' ').title()}** para documento {p['document']}.")
-            user = st.session_state.get('user') or {}
-            log_action(user.get('id'), user.get('username'), 'confirm_attendance', person_id=p['id'], slot=slot)
 
         st.markdown("---")
         st.markdown("#### Estado de registros")
         status = get_attendance_status(p["id"])
+        pending = checkin_journal.pending_for(p["document"])
         pretty = {
             "registro_dia1_manana": "Registro mañana día 1.",
             "registro_dia1_tarde":  "Registro tarde día 1.",
@@ -86,7 +87,12 @@ def page():
         for i, key in enumerate(["registro_dia1_manana","registro_dia1_tarde","registro_dia2_manana","registro_dia2_tarde"]):
             with cols[i]:
                 st.caption(pretty[key])
-                st.write(str(status.get(key)) if status.get(key) else "—")
+                if status.get(key):
+                    st.write(str(status.get(key)))
+                elif key in pending:
+                    st.write("Pendiente de sincronizar")
+                else:
+                    st.write("—")
                 if st.session_state.get("is_admin") and status.get(key):
                     if st.button(f"Borrar {i+1}", key=f"del_{key}"):
                         clear_attendance_slot(p["id"], key)
@@ -125,8 +131,7 @@ def page():
                 entity=entity.strip(),
             )
             slot = get_active_slot()
-            mark_attendance_for_slot(pid, slot)
+            checkin_journal.record(doc_new.replace(".","").replace(" ",""), slot, st.session_state.get('user'))
             st.success(f"Creado y marcado en **{slot.replace('_',' ').title()}**")
             user = st.session_state.get('user') or {}
             log_action(user.get('id'), user.get('username'), 'create_person', person_id=pid)
-            log_action(user.get('id'), user.get('username'), 'confirm_attendance', person_id=pid, slot=slot)
@@ -1,8 +1,13 @@
 
+import datetime
+import json
+
 import streamlit as st
 import pandas as pd
-import io
-from db import get_connection
+from psycopg2.extras import Json
+from db import SLOTS, connection, audit_stats, flush_audit
+from export import export_query, XLSX_MIME, CSV_MIME
+import downloads
 
 ACTIONS = [
     "create_person",
@@ -12,22 +17,67 @@ ACTIONS = [
     "update_user",
     "delete_user",
     "import_people",
+    "delete_people_bulk",
+    "delete_import_batch",
 ]
 
-def load_audit(filters):
-    conn = get_connection()
-    sql = "SELECT timestamp_utc, user_id, username, action, person_id, slot, details FROM audit_log WHERE 1=1"
+AUDIT_SELECT = "SELECT id, timestamp_utc, user_id, username, action, person_id, slot, details FROM audit_log"
+AUDIT_COLUMNS = ["id", "timestamp_utc", "user_id", "username", "action", "person_id", "slot", "details"]
+AUDIT_ORDER = "ORDER BY timestamp_utc DESC, id DESC"
+
+def _json_value(text):
+    """'12' -> 12, 'true' -> True, cualquier otro texto queda como cadena."""
+    try:
+        v = json.loads(text)
+    except ValueError:
+        return text
+    return v if isinstance(v, (int, float, bool)) or v is None else text
+
+def _audit_where(filters):
+    sql = "1=1"
     params = []
     if filters.get("action"):
         sql += " AND action = %s"; params.append(filters["action"])
     if filters.get("username"):
         sql += " AND username ILIKE %s"; params.append(f"%{filters['username']}%")
-    sql += " ORDER BY timestamp_utc DESC LIMIT 2000"
-    with conn.cursor() as cur:
-        cur.execute(sql, params)
-        rows = cur.fetchall()
-        cols = [d[0] for d in cur.description]
-    return pd.DataFrame(rows, columns=cols)
+    if filters.get("person_id") is not None:
+        sql += " AND person_id = %s"; params.append(filters["person_id"])
+    if filters.get("slot"):
+        sql += " AND slot = %s"; params.append(filters["slot"])
+    # fechas: se comparan contra la columna tal cual para que Postgres descarte particiones
+    if filters.get("date_from"):
+        sql += " AND timestamp_utc >= %s"; params.append(filters["date_from"])
+    if filters.get("date_to"):
+        sql += " AND timestamp_utc < %s"; params.append(filters["date_to"] + datetime.timedelta(days=1))
+    if filters.get("detail_key"):
+        if filters.get("detail_value"):
+            sql += " AND details @> %s"
+            params.append(Json({filters["detail_key"]: _json_value(filters["detail_value"])}))
+        else:
+            sql += " AND details ? %s"; params.append(filters["detail_key"])
+    return sql, params
+
+def load_audit(filters, after=None, page_size=200):
+    """
+    Una página de eventos, del más reciente al más antiguo. after es el
+    cursor (timestamp_utc, id) de la última fila de la página anterior.
+    Devuelve (df, cursor_siguiente o None).
+    """
+    where, params = _audit_where(filters)
+    if after is not None:
+        where += " AND timestamp_utc <= %s AND (timestamp_utc, id) < (%s, %s)"
+        params += [after[0], after[0], after[1]]
+    sql = f"{AUDIT_SELECT} WHERE {where} {AUDIT_ORDER} LIMIT %s"
+    with connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params + [page_size + 1])
+            rows = cur.fetchall()
+            cols = [d[0] for d in cur.description]
+    nxt = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        nxt = (rows[-1][1], rows[-1][0])
+    return pd.DataFrame(rows, columns=cols), nxt
 
 def page():
     if not st.session_state.get("is_admin"):
@@ -36,20 +86,77 @@ def page():
 
     st.title("Auditoría")
 
-    c1, c2 = st.columns(2)
+    c1, c2, c3, c4 = st.columns(4)
     with c1:
         action = st.selectbox("Acción", options=[""] + ACTIONS, index=0)
     with c2:
         username = st.text_input("Usuario (contiene)")
+    with c3:
+        person = st.text_input("Persona (número)")
+    with c4:
+        slot = st.selectbox("Momento", options=[""] + SLOTS, index=0,
+                            format_func=lambda s: s.replace('_', ' ').title() if s else "")
+    d1, d2, d3, d4 = st.columns(4)
+    with d1:
+        date_from = st.date_input("Desde", value=None)
+    with d2:
+        date_to = st.date_input("Hasta", value=None)
+    with d3:
+        detail_key = st.text_input("Detalle: clave (p. ej. batch_id)")
+    with d4:
+        detail_value = st.text_input("Detalle: valor (vacío = que exista la clave)")
+
+    person = person.strip()
+    if person and not person.isdigit():
+        st.warning("El número de persona debe ser numérico.")
+    filters = {
+        "action": action or None,
+        "username": username.strip() or None,
+        "person_id": int(person) if person.isdigit() else None,
+        "slot": slot or None,
+        "date_from": date_from,
+        "date_to": date_to,
+        "detail_key": detail_key.strip() or None,
+        "detail_value": detail_value.strip() or None,
+    }
+    page_size = st.selectbox("Filas por página", [100, 200, 500], index=1)
+
+    # Paginación por keyset (timestamp_utc, id); al cambiar filtros, primera página
+    filters_key = (tuple(sorted((k, str(v)) for k, v in filters.items())), page_size)
+    if st.session_state.get("audit_filters") != filters_key:
+        st.session_state["audit_filters"] = filters_key
+        st.session_state["audit_cursors"] = [None]
+    cursors = st.session_state["audit_cursors"]
 
-    df = load_audit({"action": action or None, "username": username.strip() or None})
+    flush_audit(timeout=2.0)  # que se vean los eventos aún en cola
+    df, next_after = load_audit(filters, after=cursors[-1], page_size=page_size)
 
-    st.write(f"Se encontraron **{len(df)}** eventos (máx. 2000).")
+    n1, n2, n3 = st.columns([1,1,4])
+    with n1:
+        if st.button("◀ Anterior", disabled=len(cursors) <= 1):
+            cursors.pop()
+            st.rerun()
+    with n2:
+        if st.button("Siguiente ▶", disabled=next_after is None):
+            cursors.append(next_after)
+            st.rerun()
+    with n3:
+        st.write(f"Página **{len(cursors)}** · **{len(df)}** eventos.")
+    q = audit_stats()
+    st.caption(f"Cola de escritura: {q['queued']}/{q['max']} pendientes · {q['written']} escritos · "
+               f"{q['dropped']} descartados · último lote {q['last_batch_ms']:.0f} ms")
     st.dataframe(df)
 
-    if not df.empty:
-        buf = io.BytesIO()
-        with pd.ExcelWriter(buf, engine="xlsxwriter") as w:
-            df.to_excel(w, index=False, sheet_name="auditoria")
-        st.download_button("Descargar Excel", buf.getvalue(), file_name="auditoria.xlsx",
-                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    # Exportación completa (todas las páginas), solo cuando se pide
+    e1, e2 = st.columns([2,3])
+    with e1:
+        fmt = st.radio("Formato", ["Excel (.xlsx)", "CSV"], horizontal=True, key="audit_export_fmt")
+    with e2:
+        if st.button("Preparar descarga (todos los eventos filtrados)"):
+            ext = "csv" if fmt == "CSV" else "xlsx"
+            where, params = _audit_where(filters)
+            sql = f"{AUDIT_SELECT} WHERE {where} {AUDIT_ORDER}"
+            with st.spinner("Generando archivo..."):
+                path = export_query(ext, sql, params, AUDIT_COLUMNS, sheet_name="auditoria")
+            url = downloads.publish(path, f"auditoria.{ext}", CSV_MIME if ext == "csv" else XLSX_MIME)
+            st.markdown(downloads.link(url, f"Descargar {fmt}"), unsafe_allow_html=True)
@@ -1,8 +1,17 @@
 # routes/certificates.py
+import hashlib
 import io
+import multiprocessing
 import os
 import re
-from typing import Optional
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pandas as pd
 import streamlit as st
@@ -11,38 +20,114 @@ from reportlab.pdfgen import canvas
 from reportlab.pdfbase.pdfmetrics import stringWidth
 from reportlab.lib.units import mm  # mm → puntos PDF
 
+from db import (
+    certificate_eligible, certificate_lookup, certificate_stats, get_settings, set_setting,
+    certificate_registry_version, certificate_registry_rows, load_certificate_registry,
+)
+import downloads
+from upload_cache import cached, content_hash
+
 # -------------------------------------------------------------------
 # Rutas y utilidades de archivo
 # -------------------------------------------------------------------
 ASSETS_TEMPLATE = os.path.join("assets", "certificado_base.pdf")
-RUNTIME_CACHE = "/tmp/certificados_cache.parquet"  # cache del excel normalizado
+ASSETS_REGISTRY = os.path.join("assets", "certificados.xlsx")  # opcional, si nunca se cargó uno
 
 def _template_exists() -> bool:
     return os.path.exists(ASSETS_TEMPLATE)
 
-def _save_registry(df: pd.DataFrame) -> None:
-    os.makedirs("/tmp", exist_ok=True)
-    df.to_parquet(RUNTIME_CACHE, index=False)
+def _save_registry(df: pd.DataFrame, content_hash: Optional[str] = None, username: Optional[str] = None) -> int:
+    """Carga el registro normalizado en Postgres como versión nueva y la activa."""
+    rows = zip(df["document"], df["names"], df["percent"])
+    version, count = load_certificate_registry(rows, username=username, content_hash=content_hash)
+    _set_registry_index(df, ("db", version))
+    return count
 
-def _load_registry() -> Optional[pd.DataFrame]:
+def _load_registry(key) -> Optional[pd.DataFrame]:
     """
-    Preferimos el cache de runtime (/tmp). Si no existe, intentamos assets/certificados.xlsx
-    (opcional). Si tampoco hay, devolvemos None.
+    Registro de la versión activa en Postgres. Si nunca se cargó uno,
+    assets/certificados.xlsx (opcional). Si tampoco hay, devolvemos None.
     """
-    if os.path.exists(RUNTIME_CACHE):
-        try:
-            return pd.read_parquet(RUNTIME_CACHE)
-        except Exception:
-            pass
-    # fallback: si dejas un excel fijo en assets
-    assets_xlsx = os.path.join("assets", "certificados.xlsx")
-    if os.path.exists(assets_xlsx):
-        try:
-            raw = pd.read_excel(assets_xlsx)
-            return _normalize_registry(raw)
-        except Exception:
-            return None
-    return None
+    if key is None:
+        return None
+    if key[0] == "db":
+        return pd.DataFrame(certificate_registry_rows(key[1]), columns=["document", "names", "percent"])
+    try:
+        raw = pd.read_excel(ASSETS_REGISTRY)
+        return _normalize_registry(raw)
+    except Exception:
+        return None
+
+# -------------------------------------------------------------------
+# Índice en memoria (compartido por todas las sesiones del proceso)
+# documento -> (nombre, porcentaje). Se recarga solo si cambia la versión
+# activa en Postgres (settings, avisada por NOTIFY a todos los procesos) o,
+# sin registro en la base, el archivo de assets.
+# -------------------------------------------------------------------
+_registry_lock = threading.Lock()
+_registry_key = None
+_registry_index: Dict[str, Tuple[str, float]] = {}
+
+def _registry_source():
+    """("db", versión) o ("file", ruta, mtime) de lo que usaría _load_registry(), o None."""
+    try:
+        version = certificate_registry_version()
+    except Exception:
+        version = None
+    if version is not None:
+        return ("db", version)
+    try:
+        return ("file", ASSETS_REGISTRY, os.stat(ASSETS_REGISTRY).st_mtime_ns)
+    except OSError:
+        return None
+
+def _set_registry_index(df: Optional[pd.DataFrame], key) -> None:
+    global _registry_key, _registry_index
+    index = {}
+    if df is not None and not df.empty:
+        df = df.drop_duplicates("document", keep="first")  # igual que la búsqueda anterior (primera fila)
+        index = {
+            str(d): (str(n), float(p or 0))
+            for d, n, p in zip(df["document"], df["names"], df["percent"])
+        }
+    with _registry_lock:
+        _registry_index = index
+        _registry_key = key
+
+def _get_registry_index() -> Dict[str, Tuple[str, float]]:
+    """Índice vigente; solo se recarga si cambió la versión o el archivo de origen."""
+    key = _registry_source()
+    if key != _registry_key:
+        with _registry_lock:
+            stale = key != _registry_key
+        if stale:
+            _set_registry_index(_load_registry(key), key)
+    return _registry_index
+
+# -------------------------------------------------------------------
+# Origen del registro (settings.cert_source):
+#   "excel": el Excel que sube el admin (índice en memoria de arriba)
+#   "db":    el porcentaje calculado de attendance_slots (certificate_summary)
+# -------------------------------------------------------------------
+CERT_SOURCES = {
+    "excel": "Excel cargado por el administrador",
+    "db": "Asistencia registrada en el sistema",
+}
+
+def _source() -> str:
+    try:
+        src = get_settings().get("cert_source", "excel")
+    except Exception:
+        return "excel"
+    return src if src in CERT_SOURCES else "excel"
+
+def _has_registry() -> bool:
+    return _source() == "db" or bool(_get_registry_index())
+
+def _lookup(num: str) -> Optional[Tuple[str, float]]:
+    if _source() == "db":
+        return certificate_lookup(num)
+    return _get_registry_index().get(num)
 
 # -------------------------------------------------------------------
 # Normalización de columnas
@@ -193,27 +278,193 @@ def _overlay_bytes(name: str, doc: str, w: float, h: float) -> bytes:
     buf.seek(0)
     return buf.read()
 
-def _render_certificate(name: str, doc: str) -> Optional[bytes]:
+# -------------------------------------------------------------------
+# Plantilla parseada una vez por proceso (se recarga si cambia su mtime)
+# y cache LRU de PDFs terminados: los asistentes descargan varias veces.
+# -------------------------------------------------------------------
+PDF_CACHE_MAX_BYTES = int(float(os.environ.get("CERT_PDF_CACHE_MB", "64")) * 1024 * 1024)
+
+_template_lock = threading.Lock()  # PdfReader no es thread-safe
+_template = None  # {"mtime", "reader", "w", "h", "hash"}
+
+_pdf_cache_lock = threading.Lock()
+_pdf_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_pdf_cache_bytes = 0
+
+def _get_template() -> Optional[dict]:
+    global _template
+    try:
+        mtime = os.stat(ASSETS_TEMPLATE).st_mtime_ns
+    except OSError:
+        return None
+    with _template_lock:
+        if _template is None or _template["mtime"] != mtime:
+            with open(ASSETS_TEMPLATE, "rb") as fh:
+                data = fh.read()
+            reader = PdfReader(io.BytesIO(data))
+            box = reader.pages[0].mediabox
+            _template = {
+                "mtime": mtime,
+                "reader": reader,
+                "w": float(box.width),
+                "h": float(box.height),
+                "hash": hashlib.sha1(data).hexdigest(),
+            }
+        return _template
+
+def _pdf_cache_get(key) -> Optional[bytes]:
+    with _pdf_cache_lock:
+        pdf = _pdf_cache.get(key)
+        if pdf is not None:
+            _pdf_cache.move_to_end(key)
+        return pdf
+
+def _pdf_cache_put(key, pdf: bytes) -> None:
+    global _pdf_cache_bytes
+    if len(pdf) > PDF_CACHE_MAX_BYTES:
+        return
+    with _pdf_cache_lock:
+        if key in _pdf_cache:
+            return
+        _pdf_cache[key] = pdf
+        _pdf_cache_bytes += len(pdf)
+        while _pdf_cache_bytes > PDF_CACHE_MAX_BYTES:
+            _, old = _pdf_cache.popitem(last=False)
+            _pdf_cache_bytes -= len(old)
+
+def _render_certificate(name: str, doc: str, cache: bool = True) -> Optional[bytes]:
     """
     Mezcla la plantilla con el overlay y devuelve el PDF final en bytes.
+    cache=False para generación masiva (no vale la pena guardar cada PDF).
     """
-    if not _template_exists():
+    tpl = _get_template()
+    if tpl is None:
         return None
 
-    reader = PdfReader(ASSETS_TEMPLATE)
-    page = reader.pages[0]
-    w = float(page.mediabox.width)
-    h = float(page.mediabox.height)
+    key = (doc, name, tpl["hash"])
+    pdf = _pdf_cache_get(key) if cache else None
+    if pdf is not None:
+        return pdf
 
-    overlay_reader = PdfReader(io.BytesIO(_overlay_bytes(name, doc, w, h)))
-    page.merge_page(overlay_reader.pages[0])
+    overlay_page = PdfReader(io.BytesIO(_overlay_bytes(name, doc, tpl["w"], tpl["h"]))).pages[0]
 
     writer = PdfWriter()
-    writer.add_page(page)
+    with _template_lock:
+        # add_page clona la página en el writer; la plantilla no se modifica
+        page = writer.add_page(tpl["reader"].pages[0])
+    page.merge_page(overlay_page)
     out = io.BytesIO()
     writer.write(out)
-    out.seek(0)
-    return out.read()
+    pdf = out.getvalue()
+    if cache:
+        _pdf_cache_put(key, pdf)
+    return pdf
+
+# -------------------------------------------------------------------
+# Generación masiva: procesos en paralelo, salida en streaming a ZIPs
+# -------------------------------------------------------------------
+BATCH_CHUNK = 50  # certificados por tarea enviada a cada proceso
+# Cada tarea tiene este margen; si ningún proceso responde, se aborta en vez de colgar la página
+CHUNK_TIMEOUT = float(os.environ.get("CERT_CHUNK_TIMEOUT", "300"))
+
+# Los ZIP quedan en el disco y se descargan con downloads.publish: desde el
+# disco por bloques, sin pasar por la memoria del proceso, y solo desde la
+# sesión que los generó (contienen nombres y documentos de todos). El
+# resultado se parte en ZIPs de a lo sumo CERT_ZIP_PART_MB para que cada
+# descarga sea manejable.
+ZIP_PART_MAX_BYTES = int(float(os.environ.get("CERT_ZIP_PART_MB", "150")) * 1024 * 1024)
+_ZIP_ENTRY_OVERHEAD = 128  # encabezados por archivo dentro del ZIP (aprox.)
+
+def _eligible() -> List[Tuple[str, str]]:
+    """(documento, nombre) de quienes tienen >= 75%."""
+    if _source() == "db":
+        return [(d, n or "(SIN NOMBRE)") for d, n in certificate_eligible(75)]
+    return [(d, n or "(SIN NOMBRE)") for d, (n, p) in _get_registry_index().items() if p >= 75]
+
+def _init_worker() -> None:
+    """Inicializador de cada proceso: parsea la plantilla una sola vez."""
+    _get_template()
+
+def _render_chunk(items: List[Tuple[str, str]]) -> List[Tuple[str, bytes]]:
+    """Corre en un proceso del pool."""
+    out = []
+    for doc, name in items:
+        pdf = _render_certificate(name, doc, cache=False)
+        if pdf:
+            out.append((doc, pdf))
+    return out
+
+def _generate_zip(
+    items: List[Tuple[str, str]],
+    workers: int,
+    on_progress: Optional[Callable[[int, int, float], None]] = None,
+) -> Tuple[List[str], int, float]:
+    """
+    Genera todos los certificados en `workers` procesos y los escribe en ZIPs
+    (de a lo sumo ZIP_PART_MAX_BYTES) a medida que llegan, en una carpeta nueva
+    temporal nueva. Solo hay ~2 tareas por proceso en
+    vuelo, así que la memoria no crece con el total.
+    Devuelve (rutas de los ZIP, generados, segundos).
+    """
+    out_dir = tempfile.mkdtemp(prefix="certificados_")
+    chunks = [items[i:i + BATCH_CHUNK] for i in range(0, len(items), BATCH_CHUNK)]
+    paths: List[str] = []
+    zf = None
+    part_bytes = 0
+    t0 = time.perf_counter()
+    done = 0
+    # spawn y no fork: el servidor tiene hilos (listener, auditoría, descargas)
+    # y un hijo creado con fork mientras otro hilo tiene _template_lock se
+    # bloquearía para siempre en su primer _render_certificate.
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    )
+    try:
+        pending = set()
+        it = iter(chunks)
+        while True:
+            while len(pending) < workers * 2:
+                chunk = next(it, None)
+                if chunk is None:
+                    break
+                pending.add(pool.submit(_render_chunk, chunk))
+            if not pending:
+                break
+            finished, pending = wait(pending, timeout=CHUNK_TIMEOUT, return_when=FIRST_COMPLETED)
+            if not finished:
+                raise TimeoutError(f"ningún proceso terminó su tarea en {CHUNK_TIMEOUT:.0f} s")
+            for fut in finished:
+                for doc, pdf in fut.result():
+                    if zf is None or part_bytes + len(pdf) > ZIP_PART_MAX_BYTES:
+                        if zf is not None:
+                            zf.close()
+                        paths.append(os.path.join(out_dir, f"certificados_parte_{len(paths) + 1}.zip"))
+                        # los PDFs ya vienen comprimidos: ZIP_STORED evita gastar CPU de nuevo
+                        zf = zipfile.ZipFile(paths[-1], "w", compression=zipfile.ZIP_STORED)
+                        part_bytes = 0
+                    zf.writestr(f"certificado_{doc}.pdf", pdf)
+                    part_bytes += len(pdf) + _ZIP_ENTRY_OVERHEAD
+                    done += 1
+            if on_progress:
+                on_progress(done, len(items), time.perf_counter() - t0)
+        if zf is not None:
+            zf.close()
+    except BaseException:
+        pool.shutdown(wait=False, cancel_futures=True)
+        if zf is not None:
+            zf.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+        raise
+    pool.shutdown()
+    if not paths:
+        shutil.rmtree(out_dir, ignore_errors=True)
+    if len(paths) == 1:
+        single = os.path.join(out_dir, "certificados.zip")
+        os.replace(paths[0], single)
+        paths = [single]
+    return paths, done, time.perf_counter() - t0
 
 # -------------------------------------------------------------------
 # UI: PÚBLICO (sin login)
@@ -224,8 +475,7 @@ def public_page():
         st.error("No se encontró la plantilla del certificado en **assets/certificado_base.pdf**.")
         return
 
-    df = _load_registry()
-    if df is None or df.empty:
+    if not _has_registry():
         st.warning("Aún no hay datos de asistencia cargados. Inténtelo más tarde.")
         return
 
@@ -236,13 +486,13 @@ def public_page():
             st.warning("Ingrese un documento válido.")
             return
 
-        row = df.loc[df["document"] == num]
-        if row.empty:
+        found = _lookup(num)
+        if found is None:
             st.error("El documento no aparece en la base de datos. Si considera que es un error, escriba al correo desde el cual recibió el enlace.")
             return
 
-        name = str(row.iloc[0]["names"]) or "(SIN NOMBRE)"
-        pct = float(row.iloc[0]["percent"] or 0)
+        name = found[0] or "(SIN NOMBRE)"
+        pct = found[1]
 
         if pct < 75:
             st.error(
@@ -278,46 +528,94 @@ def admin_page():
     else:
         st.success("Plantilla PDF encontrada ✅")
 
-    st.subheader("1) Cargar Excel (Documento, Nombre, Asistencia)")
-    up = st.file_uploader("Excel", type=["xlsx", "xls"])
-    if up:
-        try:
-            raw = pd.read_excel(up)
-            df = _normalize_registry(raw)
-            st.write(df.head())
-            _save_registry(df)
-            st.success(f"Registro cargado y normalizado: **{len(df)}** filas. (Guardado en runtime)")
-        except Exception as e:
-            st.error(f"No fue posible leer el Excel: {e}")
+    st.subheader("1) Origen del porcentaje de asistencia")
+    source = _source()
+    keys = list(CERT_SOURCES)
+    new_source = st.radio("Origen", keys, index=keys.index(source), format_func=CERT_SOURCES.get)
+    if new_source != source:
+        set_setting("cert_source", new_source)
+        st.rerun()
+
+    if source == "db":
+        total, eligible = certificate_stats(75)
+        st.success(f"Porcentaje calculado de los momentos registrados: **{total}** personas, "
+                   f"**{eligible}** con 75% o más. No hace falta cargar ningún archivo.")
+    else:
+        st.markdown("**Cargar Excel (Documento, Nombre, Asistencia)**")
+        up = st.file_uploader("Excel", type=["xlsx", "xls"])
+        if up:
+            try:
+                # Leído y normalizado una sola vez por contenido; en los reruns
+                # siguientes solo se vuelve a cargar si el archivo es otro.
+                h = content_hash(up)
+                df = cached(("registry", h), lambda: _normalize_registry(pd.read_excel(up)))
+                st.write(df.head())
+                if st.session_state.get("cert_registry_hash") != h:
+                    u = st.session_state.get("user") or {}
+                    st.session_state["cert_registry_count"] = _save_registry(df, h, u.get("username"))
+                    st.session_state["cert_registry_hash"] = h
+                st.success(f"Registro cargado y normalizado: **{st.session_state['cert_registry_count']}** "
+                           f"documentos (versión {certificate_registry_version()} en la base de datos).")
+            except Exception as e:
+                st.error(f"No fue posible leer el Excel: {e}")
 
     st.subheader("2) Probar generación")
-    df = _load_registry()
-    if df is None or df.empty:
+    if not _has_registry():
         st.info("Primero cargue el Excel.")
         return
 
     test_doc = st.text_input("Documento de prueba")
     if st.button("Probar"):
         num = _only_digits(test_doc)
-        row = df.loc[df["document"] == num]
-        if row.empty:
+        found = _lookup(num)
+        if found is None:
             st.warning("Documento no encontrado en el registro.")
-            return
-
-        name = str(row.iloc[0]["names"])
-        pct = float(row.iloc[0]["percent"] or 0)
-        st.write(f"Nombre: **{name}**, Asistencia: **{pct:.0f}%**")
-
-        if pct >= 75:
-            pdf = _render_certificate(name, num)
-            if pdf:
-                st.download_button(
-                    "Descargar certificado de prueba (PDF)",
-                    data=pdf,
-                    file_name=f"certificado_{num}.pdf",
-                    mime="application/pdf",
-                )
-            else:
-                st.error("No se pudo componer el PDF. Revise la plantilla.")
         else:
-            st.warning("Este documento no alcanza el 75% mínimo.")
+            name, pct = found
+            st.write(f"Nombre: **{name}**, Asistencia: **{pct:.0f}%**")
+
+            if pct >= 75:
+                pdf = _render_certificate(name, num)
+                if pdf:
+                    st.download_button(
+                        "Descargar certificado de prueba (PDF)",
+                        data=pdf,
+                        file_name=f"certificado_{num}.pdf",
+                        mime="application/pdf",
+                    )
+                else:
+                    st.error("No se pudo componer el PDF. Revise la plantilla.")
+            else:
+                st.warning("Este documento no alcanza el 75% mínimo.")
+
+    st.subheader("3) Generar todos los certificados (≥ 75%)")
+    items = _eligible()
+    st.write(f"Personas habilitadas: **{len(items)}**")
+    workers = st.number_input("Procesos en paralelo", min_value=1, max_value=64,
+                              value=os.cpu_count() or 1, step=1)
+    if st.button("Generar ZIP", disabled=not items or not _template_exists()):
+        bar = st.progress(0.0, text="Generando...")
+        metrics = st.empty()
+
+        def _progress(done, total, secs):
+            rate = done / secs if secs > 0 else 0.0
+            bar.progress(done / total if total else 1.0, text=f"{done}/{total} certificados")
+            metrics.caption(f"{rate:.0f} certificados/s · {secs:.1f} s")
+
+        try:
+            paths, done, secs = _generate_zip(items, int(workers), _progress)
+        except Exception as e:
+            st.error(f"No fue posible generar los certificados: {e}")
+            return
+        out_dir = os.path.dirname(paths[0]) if paths else None
+        st.session_state["cert_zip_urls"] = [
+            downloads.publish(path, os.path.basename(path), "application/zip", remove=out_dir) for path in paths
+        ]
+        st.success(f"Generados **{done}** certificados en {secs:.1f} s "
+                   f"({done / secs if secs else 0:.0f}/s) en {len(paths)} ZIP.")
+
+    urls = [u for u in st.session_state.get("cert_zip_urls", []) if downloads.available(u)]
+    if urls:
+        st.markdown("<br>".join(downloads.link(u) for u in urls), unsafe_allow_html=True)
+        st.caption(f"Solo se pueden descargar desde esta sesión y se borran pasados "
+                   f"{downloads.DOWNLOAD_TTL / 60:.0f} minutos.")
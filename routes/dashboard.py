@@ -0,0 +1,67 @@
+import streamlit as st
+import pandas as pd
+from db import SLOTS, attendance_counters, counters_version, rebuild_attendance_counters
+from migrations import REGISTERED
+
+SLOT_LABELS = {
+    "registro_dia1_manana": "Día 1 - Mañana",
+    "registro_dia1_tarde":  "Día 1 - Tarde",
+    "registro_dia2_manana": "Día 2 - Mañana",
+    "registro_dia2_tarde":  "Día 2 - Tarde",
+}
+
+def _frame(rows) -> pd.DataFrame:
+    return pd.DataFrame(rows, columns=["slot", "region", "entity", "n"])
+
+def _breakdown(df: pd.DataFrame, by: str, label: str) -> pd.DataFrame:
+    """Tabla por provincia/entidad: registrados y asistentes por momento."""
+    t = df.pivot_table(index=by, columns="slot", values="n", aggfunc="sum", fill_value=0)
+    t = t.reindex(columns=[REGISTERED] + SLOTS, fill_value=0)
+    t.index = t.index.where(t.index != "", "(sin dato)")
+    t = t.rename(columns={REGISTERED: "Registrados", **SLOT_LABELS})
+    t.index.name = label
+    return t.sort_values("Registrados", ascending=False)
+
+def _render(rows):
+    df = _frame(rows)
+    totals = df.groupby("slot")["n"].sum()
+    registered = int(totals.get(REGISTERED, 0))
+
+    st.metric("Registrados", f"{registered:,}")
+    cols = st.columns(len(SLOTS))
+    for col, slot in zip(cols, SLOTS):
+        n = int(totals.get(slot, 0))
+        pct = f"{n * 100 / registered:.1f}% de registrados" if registered else None
+        col.metric(SLOT_LABELS[slot], f"{n:,}", pct, delta_color="off")
+
+    tab_region, tab_entity = st.tabs(["Por provincia", "Por entidad"])
+    with tab_region:
+        st.dataframe(_breakdown(df, "region", "Provincia"), use_container_width=True)
+    with tab_entity:
+        st.dataframe(_breakdown(df, "entity", "Entidad"), use_container_width=True)
+
+@st.fragment(run_every=1)
+def _live():
+    # Solo se consulta la base cuando llega un NOTIFY attendance_changed; el
+    # resto de los ticks reutiliza las filas guardadas en la sesión.
+    version = counters_version()
+    seen = st.session_state.get("dashboard_rows")
+    if seen is None or seen[0] != version or version < 0:
+        seen = (version, attendance_counters())
+        st.session_state["dashboard_rows"] = seen
+    _render(seen[1])
+
+def page():
+    if not st.session_state.get("is_admin"):
+        st.error("Solo administradores.")
+        return
+
+    st.caption("Se actualiza solo cuando cambia la asistencia (confirmaciones, importaciones, borrados).")
+    _live()
+
+    with st.expander("Mantenimiento"):
+        st.caption("Los contadores los mantiene la base. Recalcular solo hace falta tras cambios hechos por fuera de la aplicación (p. ej. TRUNCATE).")
+        if st.button("Recalcular contadores"):
+            rebuild_attendance_counters()
+            st.session_state.pop("dashboard_rows", None)
+            st.success("Contadores recalculados.")
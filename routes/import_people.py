@@ -1,44 +1,16 @@
-
 import streamlit as st
 import pandas as pd
-import re
+from importer import (
+    TARGET, guess, normalize_people, normalize_column, mapped_columns,
+    sheet_names, read_preview, iter_chunks
+)
+from upload_cache import cached, compact, content_hash
 from db import (
-    upsert_people_bulk, log_action,
-    get_existing_documents, get_ids_by_documents,
-    create_import_batch, list_import_batches, delete_people_from_batch
+    people_import, log_action,
+    list_import_batches, delete_people_from_batch
 )
 
-TARGET = ["region","department","municipality","document","names","phone","email","position","entity"]
-
-def _norm_text(x):
-    if pd.isna(x): return ""
-    s = str(x).strip().replace("\u00a0"," ")
-    s = re.sub(r"\s+", " ", s)
-    return s
-
-def _only_digits(x):
-    return re.sub(r"\D", "", str(x or ""))
-
-def _clean_email(val: str) -> str:
-    s = str(val or "").upper().replace("ANONYMOUS", "").strip()
-    m = re.search(r"([A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,})", s)
-    return m.group(1) if m else ""
-
-def guess(col):
-    key = col.strip().lower()
-    if any(k in key for k in ["document","cedul","dni","cc","identidad"]): return "document"
-    if any(k in key for k in ["nombre","apell"]): return "names"
-    if any(k in key for k in ["telefono","celular","whatsapp","móvil","movil"]): return "phone"
-    if any(k in key for k in ["correo","email","e-mail"]): return "email"
-    if any(k in key for k in ["cargo","rol","puesto","ocupacion","ocupación"]): return "position"
-    if any(k in key for k in ["entidad","empresa","instituci","organiza"]): return "entity"
-    if any(k in key for k in ["municipio","ciudad","localidad"]): return "municipality"
-    if any(k in key for k in ["departamento","distrito","estado"]): return "department"
-    if any(k in key for k in ["provincia","región","region"]): return "region"
-    return ""
-
-def _to_upper(s: str) -> str:
-    return str(s or "").upper()
+PREVIEW_ROWS = 200
 
 def page():
     if not st.session_state.get("is_admin"):
@@ -51,14 +23,15 @@ def page():
         st.info("Sube un archivo para continuar.")
         return
 
-    # Leer archivo
-    if up.name.lower().endswith(".csv"):
-        df = pd.read_csv(up)
-        sheet = None
-    else:
-        xls = pd.ExcelFile(up, engine="openpyxl")
-        sheet = st.selectbox("Hoja", xls.sheet_names, index=0)
-        df = pd.read_excel(up, sheet_name=sheet, engine="openpyxl")
+    # Leer solo el encabezado y las primeras filas; el archivo completo se
+    # recorre por bloques únicamente al importar. Lo leído queda en cache por
+    # hash del contenido, así los reruns no vuelven a abrir el archivo.
+    h = content_hash(up)
+    sheet = None
+    if not up.name.lower().endswith(".csv"):
+        sheets = cached(("sheets", h), lambda: sheet_names(up, up.name))
+        sheet = st.selectbox("Hoja", sheets, index=0)
+    df = cached(("preview", h, sheet, PREVIEW_ROWS), lambda: read_preview(up, up.name, sheet, PREVIEW_ROWS))
 
     st.subheader("Mapeo sugerido")
     map_dest = {}
@@ -68,28 +41,19 @@ def page():
         gi = opts.index(gi_guess) if gi_guess in opts else 0
         map_dest[c] = st.selectbox(f"Destino para: **{c}**", options=opts, index=gi, key=f"map_{c}")
 
-    # Unir columnas hacia la plantilla destino
-    tmp = {}
-    for dest in TARGET:
-        cols = [src for src, d in map_dest.items() if d == dest]
-        if not cols:
-            tmp[dest] = ""
-        else:
-            tmp[dest] = df[cols].astype(str).apply(lambda r: " ".join([x for x in r if str(x).strip() and str(x).lower()!='nan']).strip(), axis=1)
-
-    people = pd.DataFrame({k: (tmp[k] if not isinstance(tmp[k], str) else pd.Series([""]*len(df))) for k in TARGET})
-
-    # Normalizaciones solicitadas
-    people["document"] = people["document"].apply(_only_digits)
-    people["phone"] = people["phone"].apply(_only_digits)
-
-    for col in ["region","department","municipality","names","email","position","entity"]:
-        people[col] = people[col].apply(_norm_text).apply(_to_upper)
-
-    people["names"] = people["names"].str.replace(r"\bNAN\b", "", regex=True).str.replace(r"\s+", " ", regex=True).str.strip()
-    people["email"] = people["email"].apply(_clean_email)
-
-    # Validaciones mínimas
+    # Unir columnas hacia la plantilla destino + normalizaciones (por columna).
+    # Cada destino se cachea por sus columnas origen: cambiar un selectbox solo
+    # recalcula los destinos afectados.
+    people = pd.DataFrame({
+        dest: cached(
+            ("norm", h, sheet, PREVIEW_ROWS, dest, tuple(cols)),
+            lambda dest=dest, cols=cols: compact(normalize_column(df, dest, cols)),
+        )
+        for dest in TARGET
+        for cols in [mapped_columns(map_dest, dest)]
+    })
+
+    # Validaciones mínimas (sobre la previsualización; el archivo completo se valida al importar)
     missing_doc = people["document"].eq("") | people["document"].isna()
     missing_names = people["names"].eq("") | people["names"].isna()
     dup_infile = people["document"].duplicated(keep="first")
@@ -102,7 +66,7 @@ def page():
     if int(dup_infile.sum()) > 0:
         errors.append(f"{int(dup_infile.sum())} duplicado(s) de DOCUMENTO en el archivo; se conservará la primera aparición.")
 
-    st.subheader("Previsualización (ya normalizado)")
+    st.subheader(f"Previsualización (ya normalizado, primeras {PREVIEW_ROWS} filas)")
     st.dataframe(people.head(50))
 
     if errors:
@@ -114,37 +78,38 @@ def page():
     can_import = (not missing_doc.any() and not missing_names.any()) or allow_skip
 
     if st.button("Importar a la base de datos", disabled=not can_import):
+        curuser = st.session_state.get('user') or {}
+        bar = st.progress(0.0, text="Importando...")
+        skipped = 0
         try:
-            # Siempre quitamos duplicados dentro del archivo
-            people2 = people[~dup_infile].copy()
-
-            # Si el usuario permitió, filtramos filas inválidas; de lo contrario, a este punto no hay inválidas
-            skipped = 0
-            if allow_skip:
-                invalid_mask = missing_doc | missing_names
-                skipped = int(invalid_mask.sum())
-                people2 = people2[~invalid_mask].copy()
-
-            rows = list(people2[TARGET].itertuples(index=False, name=None))
-            count = upsert_people_bulk(rows)
-
-            # Determinar cuáles documentos eran nuevos (no existían antes)
-            docs = [str(r[3]) for r in rows]  # position 3 = document en TARGET
-            existing = get_existing_documents(docs)
-            id_map = get_ids_by_documents(docs)
-            inserted_ids = [id_map[d] for d in docs if d not in existing and d in id_map]
-
-            # Registrar el lote
-            curuser = st.session_state.get('user') or {}
-            batch_id = create_import_batch(curuser.get('id'), curuser.get('username'), len(rows), inserted_ids)
-
-            msg = f"Importación completada. Registros procesados: {len(rows)} (upsert={count})."
+            # Todo en una transacción: si aparece una fila inválida sin permiso
+            # para omitirla, no queda nada importado.
+            with people_import(curuser.get('id'), curuser.get('username')) as imp:
+                for raw, frac in iter_chunks(up, up.name, sheet):
+                    chunk = normalize_people(raw, map_dest)
+                    invalid = chunk["document"].eq("") | chunk["names"].eq("")
+                    if invalid.any():
+                        if not allow_skip:
+                            raise ValueError(
+                                f"hay fila(s) sin DOCUMENTO o sin NOMBRES después de la fila {imp['rows'] + skipped}. "
+                                "No se importó nada; marque la opción de omitir filas inválidas."
+                            )
+                        skipped += int(invalid.sum())
+                        chunk = chunk[~invalid]
+                    imp["load"](chunk[TARGET].itertuples(index=False, name=None))
+                    bar.progress(frac, text=f"{imp['rows']} fila(s) procesadas...")
+            bar.progress(1.0, text=f"{imp['rows']} fila(s) procesadas.")
+            batch_id = imp["batch_id"]
+
+            msg = f"Importación completada. Registros procesados: {imp['rows']} (upsert={imp['processed']})."
+            if imp["duplicates"]:
+                msg += f" {imp['duplicates']} duplicado(s) de DOCUMENTO; se conservó la primera aparición."
             if allow_skip and skipped:
                 msg += f" Se omitieron {skipped} fila(s) inválidas."
-            st.success(msg + f"  Lote de importación: #{batch_id} (nuevos: {len(inserted_ids)}).")
+            st.success(msg + f"  Lote de importación: #{batch_id} (nuevos: {imp['inserted']}).")
 
             log_action(curuser.get('id'), curuser.get('username'), 'import_people',
-                       details={'rows': len(rows), 'sheet': sheet, 'normalized': True, 'skipped': skipped, 'batch_id': batch_id})
+                       details={'rows': imp['rows'], 'sheet': sheet, 'normalized': True, 'skipped': skipped, 'batch_id': batch_id})
         except Exception as ex:
             st.error(f"Error durante la importación: {ex}")
 
@@ -0,0 +1,113 @@
+import time
+from collections import deque
+from datetime import datetime
+
+import streamlit as st
+import pandas as pd
+import checkin_journal
+from db import get_active_slot, resolve_document, warm_document_map
+
+LOG_SIZE = 20
+REFRESH_SECONDS = 1
+
+RESULT_LABELS = {
+    "first": "registrado",
+    "ok": "registrado",
+    "repeat": "ya registrado",
+    "missing": "no encontrado",
+}
+PENDING = "pendiente"
+
+def _log():
+    if "kiosk_log" not in st.session_state:
+        st.session_state["kiosk_log"] = deque(maxlen=LOG_SIZE)
+    return st.session_state["kiosk_log"]
+
+def _slot():
+    """Momento activo; sin conexión se sigue con el último conocido."""
+    if checkin_journal.offline() and "kiosk_slot" in st.session_state:
+        return st.session_state["kiosk_slot"]  # no esperar a la base en cada escaneo
+    try:
+        st.session_state["kiosk_slot"] = get_active_slot()
+    except Exception:
+        if "kiosk_slot" not in st.session_state:
+            raise
+    return st.session_state["kiosk_slot"]
+
+def _scan():
+    """on_change del campo: el lector envía Enter al final de cada lectura."""
+    raw = st.session_state.get("kiosk_doc") or ""
+    st.session_state["kiosk_doc"] = ""  # listo para el siguiente escaneo
+    doc = raw.replace(".", "").replace(" ", "").strip()
+    if not doc:
+        return
+    t0 = time.perf_counter()
+    entry = {"key": None, "Hora": datetime.now().strftime("%H:%M:%S"), "Documento": doc, "Nombre": "", "Resultado": PENDING}
+    try:
+        # mapa en memoria; solo va a la base si el documento no está
+        person = resolve_document(doc, lookup=not checkin_journal.offline())
+    except Exception:
+        person = False  # sin conexión: se anota igual y se valida al sincronizar
+    if person is None:
+        entry["Resultado"] = RESULT_LABELS["missing"]
+    else:
+        entry["Nombre"] = person[1] if person else "(sin verificar)"
+        try:
+            entry["key"] = checkin_journal.record(doc, _slot(), st.session_state.get("user"))
+        except Exception as ex:
+            entry["Resultado"], entry["Nombre"] = "error", str(ex)
+    entry["ms"] = round((time.perf_counter() - t0) * 1000)
+    _log().appendleft(entry)
+
+def _refresh(log):
+    """Pasa a su resultado final las lecturas que ya se aplicaron en la base."""
+    done = checkin_journal.results(e["key"] for e in log if e["key"] and e["Resultado"] == PENDING)
+    for e in log:
+        if e["key"] in done:
+            e["Resultado"] = RESULT_LABELS.get(done[e["key"]], done[e["key"]])
+
+def _sync_line():
+    s = checkin_journal.status()
+    if not s["persistent"]:
+        st.warning("El diario local está en la ruta por defecto (CHECKIN_JOURNAL_PATH sin definir): "
+                   "si el servidor se reinicia sin conexión con la base, las confirmaciones pendientes se pierden.")
+    if s["online"] is False:
+        st.error(f"Sin conexión con la base: {s['pending']} confirmación(es) en cola local, se reintenta sola. ({s['last_error']})")
+    elif s["pending"]:
+        st.warning(f"{s['pending']} confirmación(es) pendiente(s) de sincronizar.")
+    else:
+        when = f" (última hace {time.time() - s['last_sync']:.0f} s)" if s["last_sync"] else ""
+        st.caption(f"Todo sincronizado{when}.")
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def _station():
+    # Fragmento: cada escaneo vuelve a ejecutar solo esta parte de la página, y
+    # también cada REFRESH_SECONDS para pasar las lecturas pendientes a su
+    # resultado y actualizar el estado de conexión sin esperar otro escaneo.
+    slot = _slot()
+    st.markdown(f"**Momento activo:** {slot.replace('_', ' ').title()}")
+    st.text_input("Documento", key="kiosk_doc", on_change=_scan, placeholder="Escanee o escriba y pulse Enter")
+
+    log = _log()
+    _refresh(log)
+    if log:
+        last = log[0]
+        msg = f"{last['Documento']} — {last['Nombre'] or '-'}: {last['Resultado']}"
+        if last["Resultado"] in ("registrado", PENDING):
+            st.success(msg)
+        elif last["Resultado"] == "ya registrado":
+            st.info(msg)
+        else:
+            st.error(msg)
+    _sync_line()
+    if log:
+        st.dataframe(pd.DataFrame(list(log)).drop(columns="key"), hide_index=True, use_container_width=True)
+
+def page():
+    st.caption("Modo kiosco: cada lectura confirma la asistencia en el momento activo, sin botones. "
+               "Se guarda primero en este equipo y se sincroniza con la base en segundo plano.")
+    try:
+        warm_document_map()
+    except Exception as e:
+        st.warning(f"No se pudo precargar el padrón; se buscará en la base por cada escaneo. ({e})")
+    _station()
@@ -1,12 +1,13 @@
 
 import streamlit as st
 import pandas as pd
-import io
 from db import (
-    search_people_with_slots, distinct_values,
-    get_active_slot, mark_attendance_for_slot, clear_attendance_slot, log_action,
-    delete_people_by_ids
+    search_people_page, facet_counts, people_export_query,
+    get_active_slot, mark_attendance_bulk, clear_attendance_bulk, log_action,
+    log_actions_bulk, delete_people_by_ids
 )
+from export import export_query, XLSX_MIME, CSV_MIME
+import downloads
 
 LABELS = {
     "id": "Número",
@@ -30,30 +31,50 @@ ORDER = [
     "registro_dia1_manana","registro_dia1_tarde","registro_dia2_manana","registro_dia2_tarde"
 ]
 
+def _clear_selection():
+    """Vacía la selección de todas las páginas y desmarca las casillas."""
+    st.session_state["selected_people_ids"] = set()
+    for k in [k for k in st.session_state if str(k).startswith("selpid_")]:
+        del st.session_state[k]
+    st.session_state["search_select_scope"] = None
+
 def page():
     st.title("Buscar")
 
     # Filtros
     q_text = st.text_input("Buscar por nombre o documento", value="")
-    regiones = distinct_values("region")
-    municipios = distinct_values("municipality")
-    entidades = distinct_values("entity")
+    facets = facet_counts()
+    regiones = dict(facets["region"])
+    municipios = dict(facets["municipality"])
+    entidades = dict(facets["entity"])
 
     c1, c2, c3 = st.columns(3)
     with c1:
-        sel_region = st.multiselect("Provincia (region)", regiones)
+        sel_region = st.multiselect("Provincia (region)", list(regiones), format_func=lambda v: f"{v} ({regiones[v]})")
     with c2:
-        sel_muni = st.multiselect("Municipio", municipios)
+        sel_muni = st.multiselect("Municipio", list(municipios), format_func=lambda v: f"{v} ({municipios[v]})")
     with c3:
-        sel_ent = st.multiselect("Entidad", entidades)
+        sel_ent = st.multiselect("Entidad", list(entidades), format_func=lambda v: f"{v} ({entidades[v]})")
+
+    page_size = st.selectbox("Filas por página", [100, 200, 500], index=1)
+
+    # Paginación por keyset: guardamos el after_id de cada página visitada.
+    # Si cambian los filtros volvemos a la primera página.
+    filters_key = (q_text.strip(), tuple(sel_region), tuple(sel_muni), tuple(sel_ent), page_size)
+    if st.session_state.get("search_filters") != filters_key:
+        st.session_state["search_filters"] = filters_key
+        st.session_state["search_cursors"] = [None]
+        _clear_selection()
+    cursors = st.session_state["search_cursors"]
 
     # Consulta
-    df = search_people_with_slots(
+    df, next_after = search_people_page(
         q=q_text.strip(),
         regions=sel_region,
         municipalities=sel_muni,
         entities=sel_ent,
-        limit=2000
+        after_id=cursors[-1],
+        page_size=page_size,
     )
 
     # Reordenar y renombrar
@@ -62,15 +83,31 @@ def page():
             df[col] = None
     df = df[ORDER].rename(columns=LABELS)
 
-    st.write(f"Se encontraron **{len(df)}** registros.")
-
-    # Selección por checkboxes
+    n1, n2, n3 = st.columns([1,1,4])
+    with n1:
+        if st.button("◀ Anterior", disabled=len(cursors) <= 1):
+            cursors.pop()
+            st.rerun()
+    with n2:
+        if st.button("Siguiente ▶", disabled=next_after is None):
+            cursors.append(next_after)
+            st.rerun()
+    with n3:
+        st.write(f"Página **{len(cursors)}** · **{len(df)}** registros.")
+
+    # Selección por checkboxes: se conserva al cambiar de página; 'Todos'
+    # actúa solo sobre la página visible y se desmarca al cambiar de página.
     st.session_state.setdefault("selected_people_ids", set())
+    page_scope = (filters_key, len(cursors), cursors[-1])
+    if st.session_state.get("search_select_scope") != page_scope:
+        st.session_state["search_select_scope"] = page_scope
+        st.session_state["select_all_people"] = False
+        st.session_state["select_all_master"] = False
     slot = get_active_slot()
 
     cols_actions = st.columns([1.2,2.4,2.8,2.8,2.2])
     with cols_actions[0]:
-        all_now = st.checkbox("Todos", key="select_all_people", value=False)
+        all_now = st.checkbox("Todos", key="select_all_people")
 
     with cols_actions[1]:
         if st.button("✅ Confirmar seleccionados (momento activo)"):
@@ -78,15 +115,19 @@ def page():
             if not ids:
                 st.warning("No hay personas seleccionadas.")
             else:
-                for pid in ids:
-                    try:
-                        mark_attendance_for_slot(pid, slot)
-                        u = st.session_state.get('user') or {}
-                        log_action(u.get('id'), u.get('username'), 'confirm_attendance', person_id=pid, slot=slot)
-                    except Exception as e:
-                        st.warning(f"PID {pid}: {e}")
-                st.success(f"Confirmado para {len(ids)} persona(s) en **{slot.replace('_',' ').title()}**.")
-                st.session_state["selected_people_ids"] = set()
+                u = st.session_state.get('user') or {}
+                try:
+                    res = mark_attendance_bulk(ids, slot)
+                    ok_ids = [pid for pid, r in res.items() if r == "ok"]
+                    log_actions_bulk(u.get('id'), u.get('username'), 'confirm_attendance', ok_ids, slot=slot)
+                except Exception as e:
+                    st.error(f"No fue posible confirmar: {e}")
+                    st.stop()
+                for pid, r in res.items():
+                    if r != "ok":
+                        st.warning(f"PID {pid}: {r}")
+                st.success(f"Confirmado para {len(ok_ids)} persona(s) en **{slot.replace('_',' ').title()}**.")
+                _clear_selection()
                 st.rerun()
 
     with cols_actions[2]:
@@ -98,17 +139,19 @@ def page():
                 if not st.session_state.get("is_admin", False):
                     st.error("Solo administradores.")
                 else:
-                    cleared = 0
-                    for pid in ids:
-                        try:
-                            n = clear_attendance_slot(pid, slot)
-                            if n: cleared += 1
-                            u = st.session_state.get('user') or {}
-                            log_action(u.get('id'), u.get('username'), 'clear_attendance', person_id=pid, slot=slot)
-                        except Exception as e:
-                            st.warning(f"PID {pid}: {e}")
-                    st.success(f"Borrado para {cleared} persona(s) en **{slot.replace('_',' ').title()}**.")
-                    st.session_state["selected_people_ids"] = set()
+                    u = st.session_state.get('user') or {}
+                    try:
+                        res = clear_attendance_bulk(ids, slot)
+                        cleared = [pid for pid, r in res.items() if r == "ok"]
+                        log_actions_bulk(u.get('id'), u.get('username'), 'clear_attendance', cleared, slot=slot)
+                    except Exception as e:
+                        st.error(f"No fue posible borrar: {e}")
+                        st.stop()
+                    for pid, r in res.items():
+                        if r == "no existe":
+                            st.warning(f"PID {pid}: {r}")
+                    st.success(f"Borrado para {len(cleared)} persona(s) en **{slot.replace('_',' ').title()}**.")
+                    _clear_selection()
                     st.rerun()
 
     with cols_actions[3]:
@@ -124,7 +167,7 @@ def page():
                     st.success(f"Eliminadas {deleted} persona(s) del sistema.")
                     u = st.session_state.get('user') or {}
                     log_action(u.get('id'), u.get('username'), 'delete_people_bulk', details={'count': deleted, 'ids': ids[:50]})
-                    st.session_state["selected_people_ids"] = set()
+                    _clear_selection()
                     st.rerun()
 
     with cols_actions[4]:
@@ -155,14 +198,9 @@ def page():
         st.session_state['select_all_master'] = False
         st.rerun()
 
-    # Construir selección desde los checkboxes
-    selected = set()
-    max_rows = 500
-    rows_to_show = min(len(ids_series), max_rows)
-    if len(ids_series) > max_rows:
-        st.info(f"Mostrando {max_rows} primeras filas para selección (de {len(ids_series)}). Filtra más para ver menos.")
-
-    for i in range(rows_to_show):
+    # Actualizar la selección con las casillas de esta página
+    selected = st.session_state["selected_people_ids"]
+    for i in range(len(ids_series)):
         try:
             pid = int(ids_series.iloc[i])
         except Exception:
@@ -170,7 +208,7 @@ def page():
         doc = str(docs_series.iloc[i]) if i < len(docs_series) else ""
         nm = str(names_series.iloc[i]) if i < len(names_series) else ""
         key = f"selpid_{pid}"
-        st.session_state.setdefault(key, False)
+        st.session_state.setdefault(key, pid in selected)
         c = st.columns([0.6,2.6,2.6])
         with c[0]:
             st.checkbox("", key=key)  # sin value=
@@ -178,18 +216,23 @@ def page():
         c[2].markdown(f"`{doc}`")
         if st.session_state.get(key, False):
             selected.add(pid)
-
-    st.session_state["selected_people_ids"] = selected
-    st.caption(f"Seleccionados: **{len(selected)}**")
-
-    # Exportar Excel
-    if not df.empty:
-        buffer = io.BytesIO()
-        with pd.ExcelWriter(buffer, engine="xlsxwriter") as writer:
-            df.to_excel(writer, index=False, sheet_name="personas")
-        st.download_button(
-            label="Descargar Excel",
-            data=buffer.getvalue(),
-            file_name="personas.xlsx",
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        else:
+            selected.discard(pid)
+
+    s1, s2 = st.columns([4,1])
+    s1.caption(f"Seleccionados: **{len(selected)}** (en todas las páginas)")
+    s2.button("Limpiar selección", on_click=_clear_selection, disabled=not selected)
+
+    # Exportar: todo el resultado filtrado, solo cuando se pide
+    st.markdown("#### Exportar resultados")
+    e1, e2 = st.columns([2,3])
+    with e1:
+        fmt = st.radio("Formato", ["Excel (.xlsx)", "CSV"], horizontal=True, key="people_export_fmt")
+    with e2:
+        if st.button("Preparar descarga (todos los filtrados)"):
+            ext = "csv" if fmt == "CSV" else "xlsx"
+            sql, params = people_export_query(q_text.strip(), sel_region, sel_muni, sel_ent)
+            with st.spinner("Generando archivo..."):
+                path = export_query(ext, sql, params, [LABELS[c] for c in ORDER], sheet_name="personas")
+            url = downloads.publish(path, f"personas.{ext}", CSV_MIME if ext == "csv" else XLSX_MIME)
+            st.markdown(downloads.link(url, f"Descargar {fmt}"), unsafe_allow_html=True)
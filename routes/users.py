@@ -1,61 +1,29 @@
 
 import streamlit as st
-from db import ensure_default_admin, authenticate_user_ci
-# authenticate_user puede no existir en algunas versiones: import opcional
-try:
-    from db import authenticate_user  # type: ignore
-except Exception:
-    authenticate_user = None  # type: ignore
+from db import authenticate_user_ci
 
 def login_page():
-    """Pantalla de ingreso (case-insensitive) con compatibilidad hacia atrás."""
+    """
+    Pantalla de ingreso (usuario sin distinguir mayúsculas). Solo toca la base
+    al pulsar Entrar: una consulta (o ninguna, si el usuario está en cache) y
+    una verificación bcrypt.
+    """
     st.title("Ingreso")
 
-    # Garantiza admin por defecto si hace falta
-    try:
-        ensure_default_admin()
-    except Exception:
-        pass
+    with st.form("login_form", clear_on_submit=False, border=False):
+        username = st.text_input("Usuario")
+        password = st.text_input("Contraseña", type="password")
+        submitted = st.form_submit_button("Entrar")
 
-    username = st.text_input("Usuario")
-    password = st.text_input("Contraseña", type="password")
-
-    if st.button("Entrar"):
+    if submitted:
         uname_norm = (username or "").strip().lower()
         pwd = (password or "").strip()
 
-        user_obj = None
-
-        # 1) Intento insensible a mayúsculas
         try:
-            user_obj = authenticate_user_ci(uname_norm, pwd)
+            user_obj = authenticate_user_ci(uname_norm, pwd) if uname_norm else None
         except Exception:
             user_obj = None
 
-        # 2) Fallback: authenticate_user con usuario normalizado (si existe)
-        if not user_obj and authenticate_user:
-            try:
-                res = authenticate_user(uname_norm, pwd)  # type: ignore
-                if isinstance(res, tuple) and len(res) == 2:
-                    ok, user = res
-                    user_obj = user if ok else None
-                else:
-                    user_obj = res
-            except Exception:
-                user_obj = None
-
-        # 3) Fallback: authenticate_user con nombre tal cual (si existe)
-        if not user_obj and authenticate_user and username:
-            try:
-                res = authenticate_user((username or "").strip(), pwd)  # type: ignore
-                if isinstance(res, tuple) and len(res) == 2:
-                    ok, user = res
-                    user_obj = user if ok else None
-                else:
-                    user_obj = res
-            except Exception:
-                user_obj = None
-
         if user_obj and user_obj.get("is_active", True):
             st.session_state["is_auth"] = True
             st.session_state["user"] = {
@@ -72,32 +40,29 @@ def login_page():
 # =====================
 #   Admin Users Page
 # =====================
-import bcrypt
-from db import get_connection
+from db import connection, hash_password, forget_user
 
 def _fetch_users():
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT id, username, is_admin, is_active, created_at FROM users ORDER BY id ASC")
             rows = cur.fetchall()
     return rows
 
 def _set_password(username: str, new_password: str):
-    pwd_hash = bcrypt.hashpw(new_password.encode("utf-8"), bcrypt.gensalt()).decode()
-    conn = get_connection()
-    with conn:
+    pwd_hash = hash_password(new_password)
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "UPDATE users SET password_hash=%s WHERE LOWER(username)=LOWER(%s)",
                 (pwd_hash, username.strip(),),
             )
+    forget_user(username)
 
 def _upsert_user(username: str, password: str, is_admin: bool, is_active: bool = True):
     username = username.strip().lower()
-    pwd_hash = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode()
-    conn = get_connection()
-    with conn:
+    pwd_hash = hash_password(password)
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 """
@@ -110,25 +75,26 @@ def _upsert_user(username: str, password: str, is_admin: bool, is_active: bool =
                 """,
                 (username, pwd_hash, is_admin, is_active),
             )
+    forget_user(username)
 
 def _update_flags(username: str, is_admin: bool, is_active: bool):
     username = username.strip().lower()
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute(
                 "UPDATE users SET is_admin=%s, is_active=%s WHERE LOWER(username)=LOWER(%s)",
                 (is_admin, is_active, username),
             )
+    forget_user(username)
 
 def _delete_user(username: str):
     username = username.strip().lower()
     if username == "admin":
         raise ValueError("No se puede eliminar el usuario 'admin'.")
-    conn = get_connection()
-    with conn:
+    with connection() as conn:
         with conn.cursor() as cur:
             cur.execute("DELETE FROM users WHERE LOWER(username)=LOWER(%s)", (username,))
+    forget_user(username)
 
 def page():
     # Solo admin
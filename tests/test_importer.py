@@ -0,0 +1,33 @@
+import io
+import os
+import sys
+
+import openpyxl
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from importer import guess, iter_chunks, normalize_people  # noqa: E402
+
+
+def _xlsx(rows) -> io.BytesIO:
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    for r in rows:
+        ws.append(r)
+    buf = io.BytesIO()
+    wb.save(buf)
+    buf.seek(0)
+    return buf
+
+
+def test_blank_xlsx_cells_are_empty():
+    f = _xlsx([
+        ["Documento", "Nombres", "Apellidos", "Entidad", "Cargo"],
+        ["123", "Ana", None, None, "jefe"],
+        ["456", None, None, "Alcaldía", None],
+    ])
+    raw = next(iter_chunks(f, "personas.xlsx"))[0]
+    out = normalize_people(raw, {c: guess(c) for c in raw.columns})
+    assert out["names"].tolist() == ["ANA", ""]
+    assert out["entity"].tolist() == ["", "ALCALDÍA"]
+    assert out["position"].tolist() == ["JEFE", ""]
+    assert "NONE" not in out.to_numpy().ravel().tolist()
@@ -0,0 +1,96 @@
+# upload_cache.py
+"""
+Cache de archivos subidos, compartido por las sesiones del proceso.
+
+Streamlit vuelve a ejecutar la página en cada interacción y el archivo subido
+se leía y normalizaba desde cero cada vez. Aquí se guarda lo ya calculado con
+una clave que empieza por el hash del contenido (más hoja, mapeo, etc.), en un
+LRU con tope de bytes. Los resultados normalizados se guardan compactos: las
+columnas de texto con muchos repetidos pasan a 'category'.
+"""
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+UPLOAD_CACHE_MAX_BYTES = int(os.getenv("UPLOAD_CACHE_MB", "128")) * 1024 * 1024
+
+_lock = threading.Lock()
+_cache: "OrderedDict[tuple, tuple]" = OrderedDict()  # clave -> (valor, bytes)
+_cache_bytes = 0
+_hashes: "OrderedDict[str, str]" = OrderedDict()     # file_id de Streamlit -> sha1
+_HASHES_MAX = 64
+
+def content_hash(up) -> str:
+    """sha1 del contenido; se calcula una sola vez por archivo subido."""
+    fid = getattr(up, "file_id", None)
+    if fid is not None:
+        with _lock:
+            h = _hashes.get(fid)
+        if h is not None:
+            return h
+    h = hashlib.sha1(up.getvalue()).hexdigest()
+    if fid is not None:
+        with _lock:
+            _hashes[fid] = h
+            while len(_hashes) > _HASHES_MAX:
+                _hashes.popitem(last=False)
+    return h
+
+def _compact_series(s: pd.Series) -> pd.Series:
+    if s.dtype == object and len(s) and s.nunique(dropna=False) <= len(s) // 2:
+        return s.astype("category")
+    return s
+
+def compact(data):
+    """
+    Columnas de texto con la mitad o menos de valores distintos -> category.
+    Solo para datos ya normalizados (str): en crudo, None y NaN se confundirían.
+    """
+    if isinstance(data, pd.Series):
+        return _compact_series(data)
+    return pd.DataFrame({c: _compact_series(data[c]) for c in data.columns}, index=data.index)
+
+def _sizeof(value) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(index=True, deep=True))
+    return sys.getsizeof(value)
+
+def get(key):
+    with _lock:
+        hit = _cache.get(key)
+        if hit is None:
+            return None
+        _cache.move_to_end(key)
+        return hit[0]
+
+def put(key, value) -> None:
+    global _cache_bytes
+    size = _sizeof(value)
+    if size > UPLOAD_CACHE_MAX_BYTES:
+        return
+    with _lock:
+        if key in _cache:
+            return
+        _cache[key] = (value, size)
+        _cache_bytes += size
+        while _cache_bytes > UPLOAD_CACHE_MAX_BYTES:
+            _, (_, old) = _cache.popitem(last=False)
+            _cache_bytes -= old
+
+def cached(key, compute):
+    """Devuelve el valor guardado para key o lo calcula con compute() y lo guarda."""
+    value = get(key)
+    if value is None:
+        value = compute()
+        put(key, value)
+    return value
+
+def stats() -> dict:
+    with _lock:
+        return {"entries": len(_cache), "bytes": _cache_bytes, "max_bytes": UPLOAD_CACHE_MAX_BYTES}